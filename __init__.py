@@ -1,3 +1,3 @@
-from .base_viewer import BaseWebViewer, Session
+from .base_viewer import BaseWebViewer, Session, UNCHANGED
 
 from . import utils
\ No newline at end of file
@@ -0,0 +1,228 @@
+import collections
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class BandwidthEstimator:
+    """
+    Estimates the link to one client from the frames sent and the acks coming back.
+
+    A frame counts as sent when emit returns and as delivered when its ack
+    arrives, minus the decode time the client reports. With the flow window
+    keeping a few frames in flight, acks are spaced by the round trip whether
+    the link or the latency limits the frame rate, so the link is told apart by
+    how the round trip grows with the frame size: a least squares fit of
+    round trip = base latency + size / bandwidth over the recent frames. The
+    fit needs frames of different sizes and returns None until it has them.
+
+    The largest delivery rate of the last `window` seconds (bytes since the
+    previous ack over the longer of the send and the delivery interval) is kept
+    as a lower bound for when the fit has nothing to say.
+    """
+
+    def __init__(self, window: float = 2.0, max_samples: int = 64, min_spread: float = 0.1):
+        if window <= 0:
+            raise ValueError("window must be positive")
+
+        if not isinstance(max_samples, int) or max_samples < 8:
+            raise ValueError("max_samples must be an integer greater than or equal to 8")
+
+        self.window     = window
+        self.min_spread = min_spread
+
+        self._lock       = threading.Lock()
+        self._sent       = collections.OrderedDict()  # seq -> (send time, bytes)
+        self._sent_bits  = collections.deque()        # (send time, bits)
+        self._rates      = collections.deque()        # (time, bits per second)
+        self._deliveries = collections.deque(maxlen=max_samples)  # (bytes, round trip)
+        self._last_ack: Optional[Tuple[float, float]] = None      # (send time, delivery time)
+
+    def sent(self, seq: int, num_bytes: int, now: float) -> None:
+        with self._lock:
+            self._sent[seq] = (now, num_bytes)
+            self._sent_bits.append((now, num_bytes * 8))
+            self._trim(now)
+
+    def acked(self, seq: int, decode_time: Optional[float], now: float) -> None:
+        delivered_time = now - max(0.0, decode_time or 0.0)
+
+        with self._lock:
+            # acks are cumulative, frames acked together were delivered together
+            delivered_bytes = 0
+            send_time = None
+            while self._sent and next(iter(self._sent)) <= seq:
+                _, (send_time, num_bytes) = self._sent.popitem(last=False)
+                delivered_bytes += num_bytes
+
+            if send_time is None:
+                return
+
+            self._deliveries.append((num_bytes, max(0.0, delivered_time - send_time)))
+
+            if self._last_ack is not None:
+                last_send_time, last_delivered_time = self._last_ack
+                interval = max(send_time - last_send_time, delivered_time - last_delivered_time)
+                if interval > 0:
+                    self._rates.append((now, delivered_bytes * 8 / interval))
+
+            self._last_ack = (send_time, delivered_time)
+            self._trim(now)
+
+    def get_link(self) -> Optional[Tuple[float, float]]:
+        # (base latency in seconds, seconds per byte), None without enough spread in frame sizes
+        with self._lock:
+            if len(self._deliveries) < 8:
+                return None
+
+            sizes, round_trips = np.array(self._deliveries, dtype=np.float64).T
+
+        mean_size = sizes.mean()
+        if sizes.std() < self.min_spread * mean_size:
+            return None
+
+        seconds_per_byte = np.cov(sizes, round_trips, bias=True)[0, 1] / sizes.var()
+        if seconds_per_byte <= 0:
+            # the round trip does not grow with the size, the link is not what limits
+            return float(round_trips.mean()), 0.0
+
+        return float(round_trips.mean() - seconds_per_byte * mean_size), float(seconds_per_byte)
+
+    def get_bandwidth(self) -> Optional[float]:
+        # bits per second, from the fit if it has one and the delivery rate otherwise
+        link = self.get_link()
+        if link is not None and link[1] > 0:
+            return 8.0 / link[1]
+
+        with self._lock:
+            if not self._rates:
+                return None
+
+            return max(rate for _, rate in self._rates)
+
+    def get_send_rate(self, now: float) -> float:
+        # bits per second actually sent over the window
+        with self._lock:
+            self._trim(now)
+            return sum(bits for _, bits in self._sent_bits) / self.window
+
+    def get_frame_bytes(self) -> Optional[float]:
+        # mean size of the frames sent over the window
+        with self._lock:
+            if not self._sent_bits:
+                return None
+
+            return sum(bits for _, bits in self._sent_bits) / 8.0 / len(self._sent_bits)
+
+    def _trim(self, now: float) -> None:
+        # must be called with _lock held
+        while self._rates and now - self._rates[0][0] > self.window:
+            self._rates.popleft()
+
+        while self._sent_bits and now - self._sent_bits[0][0] > self.window:
+            self._sent_bits.popleft()
+
+        # frames whose ack got lost
+        while self._sent and now - next(iter(self._sent.values()))[0] > 4 * self.window:
+            self._sent.popitem(last=False)
+
+
+class QualityController:
+    """
+    Keeps the bitrate of a session within the estimated bandwidth.
+
+    The time a frame takes to get through the link is its size over the
+    bandwidth. While that is more than `headroom` of the frame interval, the
+    link cannot carry the target frame rate: the JPEG quality goes down first
+    and the resolution scale after it, one step per `cooldown`. While frames
+    take less than half of that, or the link does not limit at all, the
+    controller probes back up every `probe_interval` seconds in the opposite
+    order, resolution first, so it recovers when the link improves. Probing
+    also varies the frame size, which the bandwidth estimate needs. Like
+    ResolutionController it holds no reference to a session.
+    """
+
+    def __init__(
+            self,
+            min_quality:    int   = 30,
+            max_quality:    int   = 90,
+            quality_step:   int   = 10,
+            min_scale:      float = 0.25,
+            scale_step:     float = 0.8,
+            headroom:       float = 0.8,
+            cooldown:       float = 0.5,
+            probe_interval: float = 1.0,
+        ):
+        if not isinstance(min_quality, int) or not 1 <= min_quality <= 100:
+            raise ValueError("min_quality must be an integer between 1 and 100")
+
+        if not isinstance(max_quality, int) or not min_quality <= max_quality <= 100:
+            raise ValueError("max_quality must be an integer between min_quality and 100")
+
+        if not 0 < min_scale <= 1:
+            raise ValueError("min_scale must be in (0, 1]")
+
+        if not 0 < scale_step < 1:
+            raise ValueError("scale_step must be in (0, 1)")
+
+        if not 0 < headroom <= 1:
+            raise ValueError("headroom must be in (0, 1]")
+
+        self.min_quality    = min_quality
+        self.max_quality    = max_quality
+        self.quality_step   = quality_step
+        self.min_scale      = min_scale
+        self.scale_step     = scale_step
+        self.headroom       = headroom
+        self.cooldown       = cooldown
+        self.probe_interval = probe_interval
+
+        self.quality = max_quality
+        self.scale   = 1.0
+
+        self._last_change = None
+
+    def update(
+            self,
+            now:               float,
+            seconds_per_byte:  Optional[float],
+            frame_bytes:       Optional[float],
+            target_frame_rate: float,
+        ) -> Tuple[int, float]:
+        # returns (quality, resolution scale); seconds_per_byte comes from
+        # BandwidthEstimator.get_link() and frame_bytes is the recent mean frame size
+        if frame_bytes is None:
+            return self.quality, self.scale
+
+        if self._last_change is None:
+            self._last_change = now
+
+        since_change = now - self._last_change
+        budget = self.headroom / target_frame_rate
+
+        if seconds_per_byte is not None and frame_bytes * seconds_per_byte > budget:
+            if since_change >= self.cooldown:
+                self._step_down()
+                self._last_change = now
+        elif seconds_per_byte is None or frame_bytes * seconds_per_byte < budget / 2:
+            if since_change >= self.probe_interval:
+                self._step_up()
+                self._last_change = now
+
+        return self.quality, self.scale
+
+    def get_state(self) -> Dict:
+        return {"quality": self.quality, "scale": self.scale}
+
+    def _step_down(self) -> None:
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - self.quality_step)
+        else:
+            self.scale = max(self.min_scale, self.scale * self.scale_step)
+
+    def _step_up(self) -> None:
+        if self.scale < 1.0:
+            self.scale = min(1.0, self.scale / self.scale_step)
+        else:
+            self.quality = min(self.max_quality, self.quality + self.quality_step)
@@ -1,34 +1,105 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import copy
+import functools
 import json
-import cv2
 import numpy as np
 import io
 import threading
 import time
-import hashlib
-from typing import Optional, Union, Callable, List, Dict, Tuple
+import traceback
+import zlib
+from typing import Any, Optional, Union, Callable, List, Dict, Sequence, Tuple
 from abc import ABC, abstractmethod
 from .controls import *
 from .utils import *
+from .render_pool import RenderWorkerPool
+from .process_render import ProcessRenderPool
+from .batch_render import BatchRenderScheduler, RenderRequest
+from .shm_source import SharedMemoryFrameSource
+from .pipeline import FramePipeline
+from .tiles import DeltaFrame, TileDeltaEncoder
+from .lossless import LosslessDeltaEncoder
+from .buffers import FrameBufferPool, as_image
+from .flow import FlowWindow
+from .broadcast import FrameBroadcaster
+from .resolution import ResolutionController
+from .bandwidth import BandwidthEstimator, QualityController
+from .stats import SessionStats, format_prometheus, frame_bytes
+from .encoders import FrameEncoder, JpegEncoder, calibrate_encoders, choose_encoder, create_encoder
+from .inputs import (
+    INPUT_BUTTON,
+    INPUT_CONTROL,
+    INPUT_MOVE,
+    INPUT_STAMP,
+    INPUT_WHEEL,
+    InputStamp,
+    MouseMoveCoalescer,
+    decode_input_batch,
+)
+from concurrent.futures import Executor, ThreadPoolExecutor
 import uuid
 
 
+class _Unchanged:
+
+    def __repr__(self):
+        return "UNCHANGED"
+
+
+# returned by render() to signal that the previous frame is still valid
+UNCHANGED = _Unchanged()
+
+
+def frame_fingerprint(image: np.ndarray, stride: int = 1, extra: Tuple = ()) -> Tuple:
+    if stride > 1:
+        image = image[::stride, ::stride]
+
+    # runs on the render thread for every frame, so it must cost well below an encode;
+    # crc32 is several times cheaper than a cryptographic hash and only compared
+    # against the previous frame of the same session
+    return (image.shape, image.dtype.str, *extra, zlib.crc32(np.ascontiguousarray(image).data))
+
+
+class _EncodedDelta:
+    # a delta frame on its way from the encode stage to _send_frame, with what
+    # is needed to encode it again if another frame is sent first
+
+    def __init__(self, delta: DeltaFrame, format: str, image: np.ndarray, padding_x: int, padding_y: int):
+        self.delta     = delta
+        self.format    = format
+        self.image     = image
+        self.padding_x = padding_x
+        self.padding_y = padding_y
+
+
+# returned by Session._commit_delta_frame for a delta diffed against an outdated reference
+_STALE = object()
+
+
 class Session:
 
+    UNCHANGED = UNCHANGED
+
     def __init__(
             self,
             width                 : Optional[int] = None,
             height                : Optional[int] = None,
             *,
             sid                   : Optional[str] = None,
-            min_pixel             : int           = 256,
-            max_pixel             : int           = 1024,
-            target_frame_rate     : float         = 60.0,
-            adjustment_step       : float         = 0.05,
+            min_pixel             : Optional[int]   = None,
+            max_pixel             : Optional[int]   = None,
+            target_frame_rate     : float           = 60.0,
+            adjustment_step       : Optional[float] = None,
             use_dynamic_resolution: bool          = True,
             force_fix_aspect_ratio: bool          = True,
+            skip_unchanged_frames : bool          = True,
+            fingerprint_stride    : int           = 1,
+            render_on_demand      : bool          = False,
+            max_frames_in_flight  : Optional[int] = 2,
+            progressive_refinement: bool          = False,
+            refinement_delay      : float         = 0.3,
+            refinement_steps      : int           = 1,
         ):
         self._sid = sid
 
@@ -41,6 +112,7 @@ class Session:
 
         self._controls_names = []
         self._controls = {}
+        self._control_handlers: Dict[str, Callable[[Dict], None]] = {}
 
         if self.image_height is not None and self.image_width is not None:
             self.render_aspect_ratio = self.image_height / self.image_width
@@ -51,16 +123,70 @@ class Session:
 
         self.target_frame_rate = target_frame_rate
         self.frame_interval    = 1.0 / self.target_frame_rate
-        self.adjustment_step   = adjustment_step
+        self.adjustment_step   = adjustment_step if adjustment_step is not None else 0.3
+
+        self.resolution_controller = ResolutionController()
+        self.stats                 = SessionStats()
 
         self.use_dynamic_resolution = use_dynamic_resolution
         self.force_fix_aspect_ratio = force_fix_aspect_ratio
 
+        self.skip_unchanged_frames = skip_unchanged_frames
+        self.fingerprint_stride    = fingerprint_stride
+
+        self.render_on_demand   = render_on_demand
+        self._redraw_cond       = threading.Condition()
+        self._redraw_requested  = True
+        self._scheduler         = None
+        self._pipeline: Optional[FramePipeline] = None
+        self._delta_encoder: Optional[Union[TileDeltaEncoder, LosslessDeltaEncoder]] = None
+        self._sent_padding = None
+        self._encoder: FrameEncoder = JpegEncoder()
+        self._calibration = None
+        self.encoder_calibration: Optional[List[Dict]] = None
+        self._buffer_pool: Optional[FrameBufferPool] = None
+
+        self._stop_event     = threading.Event()
+        self._finished_event = threading.Event()
+
+        # frame flow control, per client when broadcasting
+        self.max_frames_in_flight = max_frames_in_flight
+        self.replaced_frames      = 0
+        self._flow_lock           = threading.Lock()
+        self._flow_window         = FlowWindow(max_frames_in_flight if sid is not None else None)
+        self._broadcaster: Optional[FrameBroadcaster] = None
+        self._frame_seq           = 0
+        self._bandwidth: Optional[BandwidthEstimator] = None
+        self._quality_controller: Optional[QualityController] = None
+        self.bandwidth_scale      = 1.0
+        self._pending_frame       = None
+        self._render_deferred     = False
+
+        # sharper frames once the user stops interacting
+        self.progressive_refinement = progressive_refinement
+        self.refinement_delay       = refinement_delay
+        self.refinement_steps       = refinement_steps
+        self._last_interaction_time = 0.0
+        self._refinement_step       = 0
+        self._interactive_size: Optional[Tuple[int, int]] = None
+
+        # mouse moves applied once per frame on the render thread, and before any button
+        # or wheel event so those see the moves queued ahead of them; the lock keeps the
+        # handlers of both threads in input order
+        self._mouse_moves: Optional[MouseMoveCoalescer] = None
+        self._mouse_move_handler: Optional[Callable[["Session"], None]] = None
+        self._mouse_lock = threading.RLock()
+        self.mouse_samples: List[Tuple[int, int]] = []
+
+        # latest stamped input, echoed back with the frames that reflect it
+        self._input_stamp: Optional[InputStamp] = None
+        self._last_emitted_input = None
+
         self.left_mouse_pressing   = False
         self.right_mouse_pressing  = False
 
-        self.min_pixel = min_pixel
-        self.max_pixel = max_pixel
+        self.min_pixel = min_pixel if min_pixel is not None else 256
+        self.max_pixel = max_pixel if max_pixel is not None else 1024
 
         self.x      = 0
         self.y      = 0
@@ -69,6 +195,8 @@ class Session:
         
         self.padding_x = 0
         self.padding_y = 0
+        # size of the last frame sent, which the padding belongs to
+        self.frame_size: Optional[Tuple[int, int]] = None
 
         self.manually_image_width = None
         self.manually_image_height = None
@@ -120,26 +248,34 @@ class Session:
         
         return width, height
 
-    def adjust_image_size(self, render_time: float):
-        if render_time <= 0:
-            return
-        
-        actual_frame_rate = 1.0 / render_time
-        ratio = actual_frame_rate / self.target_frame_rate
-        if ratio < 1:
-            min_scale_factor = self.min_pixel / max(self.image_width, self.image_height)
-            scale_factor = max(min_scale_factor, ratio)
-        else:
-            max_scale_factor = self.max_pixel / min(self.image_width, self.image_height)
-            scale_factor = min(max_scale_factor, ratio)
-
-        target_width = int(self.image_width * scale_factor)
-        target_height = int(self.image_height * scale_factor)
-
-        new_width = clip(int(self.image_width + (target_width - self.image_width) * self.adjustment_step), self.min_pixel, self.max_pixel)
-        new_height = clip(int(self.image_height + (target_height - self.image_height) * self.adjustment_step), self.min_pixel, self.max_pixel)
+    def adjust_image_size(self, render_time: Optional[float] = None):
+        if render_time is not None:
+            # a whole-frame measurement, the render loop records each stage itself
+            self.resolution_controller.record("render", render_time, self.image_width * self.image_height)
 
-        new_width, new_height = self.clamp_with_ratio(new_width, new_height)
+        if self.canvas_width is not None and self.canvas_height is not None:
+            canvas_size = (self.canvas_width, self.canvas_height)
+        else:
+            canvas_size = None
+
+        max_pixel = self.max_pixel
+        if self.bandwidth_scale < 1.0:
+            # bandwidth adaptation caps the size below what the canvas and max_pixel allow
+            max_pixel = max(self.min_pixel, int(max_pixel * self.bandwidth_scale))
+            if canvas_size is not None:
+                canvas_size = (canvas_size[0] * self.bandwidth_scale, canvas_size[1] * self.bandwidth_scale)
+
+        new_width, new_height = self.resolution_controller.update(
+            self.image_width,
+            self.image_height,
+            aspect_ratio      = self.render_aspect_ratio,
+            target_frame_rate = self.target_frame_rate,
+            min_pixel         = self.min_pixel,
+            max_pixel         = max_pixel,
+            gain              = self.adjustment_step,
+            canvas_size       = canvas_size,
+            pipelined         = self._pipeline is not None,
+        )
 
         if new_width != self.image_width or new_height != self.image_height:
             self.image_width = new_width
@@ -154,12 +290,16 @@ class Session:
     def get_cursor_position_in_pixel(self):
         _x, _y = self.get_cursor_position()
         
+        # the letterboxed frame is stretched over the whole canvas by the client
         if self.manually_image_height is not None:
             image_width  = self.manually_image_width + 2 * self.padding_x
             image_height = self.manually_image_height + 2 * self.padding_y
+        elif self.frame_size is not None:
+            image_width  = self.frame_size[0] + 2 * self.padding_x
+            image_height = self.frame_size[1] + 2 * self.padding_y
         else: 
-            image_width  = self.image_width
-            image_height = self.image_height
+            image_width  = self.image_width + 2 * self.padding_x
+            image_height = self.image_height + 2 * self.padding_y
             
         return (_x * image_width / self.canvas_width - self.padding_x,
                 _y * image_height / self.canvas_height - self.padding_y)
@@ -188,6 +328,382 @@ class Session:
             raise RuntimeError("set_force_fix_aspect_ratio takes a bool as input")
         
         self.force_fix_aspect_ratio = is_force_fix_aspect_ratio
+
+    def set_frame_change_detection(self, enabled: bool, stride: int = 1):
+        if not isinstance(enabled, bool):
+            raise RuntimeError("set_frame_change_detection takes a bool as input")
+
+        if not isinstance(stride, int) or stride < 1:
+            raise ValueError("stride must be an integer greater than or equal to 1")
+
+        self.skip_unchanged_frames = enabled
+        self.fingerprint_stride    = stride
+        self.last_image_hash       = None
+
+    def invalidate(self):
+        # the next rendered frame is sent in full even if it is identical to the last one
+        self.last_image_hash = None
+        self.request_keyframe()
+
+    def request_keyframe(self):
+        delta_encoder = self._delta_encoder
+        if delta_encoder is not None:
+            delta_encoder.request_keyframe()
+
+    def enable_delta_frames(
+            self,
+            tile_size:         int   = 64,
+            keyframe_interval: int   = 120,
+            max_changed_ratio: float = 0.5,
+        ):
+        if self._broadcaster is not None:
+            raise RuntimeError("delta frames are not supported on broadcasting sessions")
+
+        self._delta_encoder = TileDeltaEncoder(tile_size, keyframe_interval, max_changed_ratio)
+
+    def disable_delta_frames(self):
+        self._delta_encoder = None
+
+    def enable_lossless_frames(self, keyframe_interval: int = 120, mode: str = "xor", level: int = 1):
+        # zlib keyframes and residuals against the previous frame instead of JPEG, for label
+        # maps and heatmaps; replaces tile delta frames, disable with disable_delta_frames()
+        if self._broadcaster is not None:
+            raise RuntimeError("lossless delta frames are not supported on broadcasting sessions")
+
+        self._delta_encoder = LosslessDeltaEncoder(keyframe_interval, mode, level)
+
+    def set_encoder(self, encoder: Union[str, FrameEncoder], **options):
+        # e.g. set_encoder("jpeg", quality=80, subsampling="444"), see encoders.ENCODERS
+        self._encoder = create_encoder(encoder, **options)
+        self.request_keyframe()
+
+    def get_encoder(self) -> FrameEncoder:
+        return self._encoder
+
+    def enable_encoder_calibration(
+            self,
+            max_bytes:  Optional[int] = None,
+            candidates: Optional[Sequence] = None,
+            num_frames: int = 5,
+        ):
+        # the next num_frames rendered frames are kept and every candidate encoder is tried
+        # on them, then the session switches to the fastest one whose frames fit max_bytes
+        if not isinstance(num_frames, int) or num_frames < 1:
+            raise ValueError("num_frames must be an integer greater than or equal to 1")
+
+        self._calibration = (max_bytes, candidates, num_frames, [])
+
+    def _collect_calibration_frame(self, image: np.ndarray):
+        calibration = self._calibration
+        if calibration is None:
+            return
+
+        max_bytes, candidates, num_frames, frames = calibration
+        frames.append(image.copy())
+        if len(frames) < num_frames:
+            return
+
+        self._calibration = None
+
+        # trying every candidate takes a while, the session keeps sending frames meanwhile
+        thread = threading.Thread(
+            target = self._calibrate_encoders,
+            args   = (frames, candidates, max_bytes),
+            name   = "webviewer-calibration",
+            daemon = True,
+        )
+        thread.start()
+
+    def _calibrate_encoders(self, frames: List[np.ndarray], candidates: Optional[Sequence], max_bytes: Optional[int]):
+        results = calibrate_encoders(frames, candidates)
+        if self.is_stopped():
+            return
+
+        self.encoder_calibration = results
+        # candidates given as encoders are shared by the sessions
+        self.set_encoder(choose_encoder(results, max_bytes).copy())
+
+    def enable_bandwidth_adaptation(self, **options):
+        # lowers the encoder quality, then the resolution, while the link to the client cannot
+        # carry the target frame rate and raises them again once it can, see
+        # bandwidth.QualityController; the resolution only changes with dynamic resolution
+        if self._broadcaster is not None:
+            raise RuntimeError("bandwidth adaptation is not supported on broadcasting sessions")
+
+        controller = QualityController(**options)
+        if not hasattr(self._encoder, "set_quality"):
+            # nothing to turn down but the resolution
+            controller.quality = controller.min_quality
+
+        self._quality_controller = controller
+        self._bandwidth = BandwidthEstimator()
+
+    def disable_bandwidth_adaptation(self):
+        self._quality_controller = None
+        self._bandwidth = None
+        self.bandwidth_scale = 1.0
+
+    def _adapt_to_bandwidth(self):
+        controller = self._quality_controller
+        bandwidth = self._bandwidth
+        if controller is None or bandwidth is None:
+            return
+
+        now = time.time()
+        link = bandwidth.get_link()
+        quality, self.bandwidth_scale = controller.update(
+            now,
+            link[1] if link is not None else None,
+            bandwidth.get_frame_bytes(),
+            self.target_frame_rate,
+        )
+
+        encoder = self._encoder
+        if hasattr(encoder, "set_quality") and encoder.quality != quality:
+            # quality changes need no keyframe, unlike set_encoder()
+            encoder.set_quality(quality)
+
+        self.stats.set_bandwidth(
+            quality   = getattr(self._encoder, "quality", None),
+            scale     = self.bandwidth_scale,
+            estimated = bandwidth.get_bandwidth(),
+            sent      = bandwidth.get_send_rate(now),
+        )
+
+    def enable_frame_buffers(self, channels: int = 3, dtype = np.uint8, max_buffers: int = 4):
+        # render_func is then called with a preallocated `out` array of the current size
+        self._buffer_pool = FrameBufferPool(channels, dtype, max_buffers)
+
+    def disable_frame_buffers(self):
+        self._buffer_pool = None
+
+    def enable_mouse_move_coalescing(self, on_mouse_move: Callable[["Session"], None], keep_samples: bool = False):
+        # on_mouse_move is then called at most once per frame, from the render thread
+        self._mouse_move_handler = on_mouse_move
+        self._mouse_moves = MouseMoveCoalescer(keep_samples)
+
+    def disable_mouse_move_coalescing(self):
+        self._apply_mouse_moves()
+        self._mouse_moves = None
+
+    def queue_mouse_move(self, x: int, y: int, last_x: int, last_y: int) -> bool:
+        # returns False if moves are not coalesced and have to be applied right away
+        mouse_moves = self._mouse_moves
+        if mouse_moves is None:
+            return False
+
+        mouse_moves.push(x, y, last_x, last_y)
+        return True
+
+    def set_render_on_demand(self, enabled: bool):
+        if not isinstance(enabled, bool):
+            raise RuntimeError("set_render_on_demand takes a bool as input")
+
+        self.render_on_demand = enabled
+        self.request_redraw()
+
+    def set_max_frames_in_flight(self, max_frames_in_flight: Optional[int]):
+        if max_frames_in_flight is not None:
+            if not isinstance(max_frames_in_flight, int) or max_frames_in_flight < 1:
+                raise ValueError("max_frames_in_flight must be None or an integer greater than or equal to 1")
+
+        self.max_frames_in_flight = max_frames_in_flight
+
+        with self._flow_lock:
+            if self._sid is not None:
+                self._flow_window.max_frames_in_flight = max_frames_in_flight
+
+        if self._broadcaster is not None:
+            self._broadcaster.set_max_frames_in_flight(max_frames_in_flight)
+
+    def get_client_frame_time(self) -> float:
+        if self._broadcaster is not None:
+            return self._broadcaster.get_frame_time()
+
+        return self._flow_window.frame_time
+
+    def enable_broadcast(self, socketio):
+        # every frame is encoded once and fanned out to the subscribed clients
+        self._delta_encoder = None
+        self.disable_bandwidth_adaptation()
+        self._broadcaster = FrameBroadcaster(socketio, self.max_frames_in_flight)
+
+    def add_subscriber(self, sid: str):
+        if self._broadcaster is None:
+            raise RuntimeError("add_subscriber requires enable_broadcast")
+
+        self._broadcaster.subscribe(sid)
+        self.request_redraw()
+
+    def remove_subscriber(self, sid: str):
+        if self._broadcaster is not None:
+            self._broadcaster.unsubscribe(sid)
+
+    def set_progressive_refinement(self, enabled: bool, delay: float = 0.3, steps: int = 1):
+        if not isinstance(enabled, bool):
+            raise RuntimeError("set_progressive_refinement takes a bool as input")
+
+        if not isinstance(delay, (int, float)) or delay < 0:
+            raise ValueError("delay must be a non-negative number")
+
+        if not isinstance(steps, int) or steps < 1:
+            raise ValueError("steps must be an integer greater than or equal to 1")
+
+        self.progressive_refinement = enabled
+        self.refinement_delay       = delay
+        self.refinement_steps       = steps
+        self.request_redraw()
+
+    def notify_interaction(self, events: int = 1):
+        # events is the number of input events behind the interaction, 0 for none
+        self._last_interaction_time = time.time()
+        if events:
+            self.stats.record_input(events)
+        self.request_redraw()
+
+    def record_input_stamp(self, input_id: int, client_time: float, sid: Optional[str] = None):
+        self._input_stamp = InputStamp(input_id, client_time, time.time(), sid)
+
+    def record_input_latency(self, latency: float):
+        # end to end latency in seconds as measured by the client
+        if latency >= 0:
+            self.stats.record_latency("client", latency)
+
+    def get_dropped_frames(self) -> Dict[str, int]:
+        pipeline = self._pipeline
+        broadcaster = self._broadcaster
+
+        return {
+            "dropped_in_pipeline": pipeline.dropped_frames if pipeline is not None else 0,
+            "replaced_pending":    self.replaced_frames,
+            "skipped_by_clients":  broadcaster.skipped_frames if broadcaster is not None else 0,
+        }
+
+    def get_stats(self) -> Dict:
+        stats = self.stats.snapshot()
+        stats["frames"].update(self.get_dropped_frames())
+        stats["width"]             = self.image_width
+        stats["height"]            = self.image_height
+        stats["target_fps"]        = self.target_frame_rate
+        stats["client_frame_time"] = self.get_client_frame_time()
+
+        return stats
+
+    def is_interacting(self) -> bool:
+        if self.left_mouse_pressing or self.right_mouse_pressing:
+            return True
+
+        return time.time() - self._last_interaction_time < self.refinement_delay
+
+    def _is_refined(self) -> bool:
+        return self.progressive_refinement and self._refinement_step >= self.refinement_steps
+
+    def _get_refined_size(self, step: int) -> Tuple[int, int]:
+        base_width, base_height = self._interactive_size
+
+        # no point in rendering more pixels than the canvas shows
+        if self.render_aspect_ratio < 1.0:
+            full_width = self.max_pixel
+            if self.canvas_width is not None:
+                full_width = min(full_width, int(self.canvas_width))
+
+            full_width  = max(full_width, base_width)
+            full_height = max(1, int(full_width * self.render_aspect_ratio))
+        else:
+            full_height = self.max_pixel
+            if self.canvas_height is not None:
+                full_height = min(full_height, int(self.canvas_height))
+
+            full_height = max(full_height, base_height)
+            full_width  = max(1, int(full_height / self.render_aspect_ratio))
+
+        # the bandwidth cap applies to refined frames as much as to interactive ones
+        if self.bandwidth_scale < 1.0:
+            full_width  = max(base_width, int(full_width * self.bandwidth_scale))
+            full_height = max(base_height, int(full_height * self.bandwidth_scale))
+
+        fraction = (step + 1) / self.refinement_steps
+
+        return (int(base_width + (full_width - base_width) * fraction),
+                int(base_height + (full_height - base_height) * fraction))
+
+    def request_redraw(self):
+        with self._redraw_cond:
+            self._redraw_requested = True
+            self._refinement_step  = 0
+            self._redraw_cond.notify_all()
+
+        if self._scheduler is not None:
+            self._scheduler.wake(self)
+
+    def stop(self):
+        self._stop_event.set()
+        self.request_redraw()
+
+    def is_stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        return self._finished_event.wait(timeout)
+
+    def _finish(self):
+        self._stop_event.set()
+        self.disable_pipeline()
+        self._finished_event.set()
+
+    def enable_pipeline(
+            self,
+            executor:       Optional[Executor] = None,
+            encode_workers: int                = 2,
+            queue_depth:    int                = 2,
+            drop_policy:    str                = "drop_oldest",
+        ):
+        pipeline = FramePipeline(
+            executor,
+            encode_workers = encode_workers,
+            queue_depth    = queue_depth,
+            drop_policy    = drop_policy,
+        )
+
+        self.disable_pipeline()
+        self._pipeline = pipeline
+
+    def disable_pipeline(self):
+        pipeline, self._pipeline = self._pipeline, None
+
+        if pipeline is not None:
+            pipeline.close()
+
+    def _is_canvas_ready(self) -> bool:
+        return self.image_width is not None and self.image_height is not None
+
+    def _wait_for_canvas(self) -> bool:
+        with self._redraw_cond:
+            self._redraw_cond.wait_for(lambda: self.is_stopped() or self._is_canvas_ready())
+
+        return not self.is_stopped()
+
+    def _wait_for_redraw(self) -> bool:
+        with self._redraw_cond:
+            if self.render_on_demand or self._is_refined():
+                self._redraw_cond.wait_for(lambda: self.is_stopped() or self._redraw_requested)
+
+            self._redraw_requested = False
+
+        return not self.is_stopped()
+
+    def _take_redraw_request(self) -> bool:
+        # non-blocking counterpart of _wait_for_redraw used by the render pool
+        with self._redraw_cond:
+            if self.is_stopped() or not self._is_canvas_ready():
+                return False
+
+            if (self.render_on_demand or self._is_refined()) and not self._redraw_requested:
+                return False
+
+            self._redraw_requested = False
+
+        return True
         
     def set_fixed_resolution(
             self,
@@ -224,7 +740,7 @@ class Session:
             self.min_pixel = min_pixel
         
         if max_pixel is not None:
-            if not isinstance(max_pixel, int) or max_pixel < min_pixel:
+            if not isinstance(max_pixel, int) or max_pixel < self.min_pixel:
                 raise ValueError("max_pixel must be an integer greater than or equal to min_pixel")
 
             self.max_pixel = max_pixel
@@ -235,68 +751,383 @@ class Session:
             
             self.adjustment_step = adjustment_step
 
-    def start(self, socketio, render_func):
-        render_time = 0
 
-        # wait for canvas init
-        while True:
-            if self.image_width is not None and self.image_height is not None:
-                break
-            else:
-                time.sleep(0.2)
+    def _encode_frame(self, image: np.ndarray, padding_x: int, padding_y: int):
+        # the letterbox is not encoded, the client draws the image inside the padding
+        encoder = self._encoder
+
+        delta_encoder = self._delta_encoder
+        if delta_encoder is not None:
+            # diffed here against a snapshot of the last frame that was sent,
+            # _send_frame only checks that the snapshot is still current
+            return _EncodedDelta(delta_encoder.encode(image, encoder.encode), encoder.format, image, padding_x, padding_y)
+
+        return {
+            'type':      'key',
+            'format':    encoder.format,
+            'image':     encoder.encode(image),
+            'width':     image.shape[1],
+            'height':    image.shape[0],
+            'padding_x': padding_x,
+            'padding_y': padding_y,
+        }
+
+    def _commit_delta_frame(self, encoded: "_EncodedDelta"):
+        # must be called with _flow_lock held; _STALE if another frame was sent since the diff
+        delta = encoded.delta
+        if delta.encoder is not self._delta_encoder or not delta.encoder.commit(delta):
+            return _STALE
+
+        padding = (encoded.padding_x, encoded.padding_y)
+
+        frame = delta.frame
+        if frame is None:
+            if padding == self._sent_padding:
+                return None
+
+            # only the letterbox changed
+            frame = {'type': 'delta', 'tiles': []}
+
+        self._sent_padding = padding
+        frame.setdefault('format', encoded.format)
+        frame['padding_x'] = encoded.padding_x
+        frame['padding_y'] = encoded.padding_y
+
+        return frame
+
+    def _is_flow_window_full(self) -> bool:
+        broadcaster = self._broadcaster
+        if broadcaster is not None:
+            return broadcaster.is_congested()
+
+        with self._flow_lock:
+            # a parked frame goes out once the window has room again, also when an ack was
+            # lost and the window freed the slot by timing it out, as no ack will flush it
+            if self._pending_frame is not None and not self._flow_window.is_full():
+                self._flush_pending_frame()
+
+            return self._flow_window.is_full()
+
+    def _flush_pending_frame(self) -> bool:
+        # must be called with _flow_lock held; False if the pending frame was a stale delta,
+        # which is not encoded again here, a new frame replaces it
+        pending, self._pending_frame = self._pending_frame, None
+        if pending is None or self._send_frame(*pending):
+            return True
+
+        self.last_image_hash = None
+        return False
+
+    def _emit_frame(self, socketio, frame, timing: Optional[Dict] = None):
+        if timing is not None:
+            timing = dict(timing, encoded=time.time())
+
+        broadcaster = self._broadcaster
+        if broadcaster is not None:
+            if isinstance(frame, _EncodedDelta):
+                # encoded before broadcasting was enabled, which turns delta frames off
+                frame = self._encode_frame(frame.image, frame.padding_x, frame.padding_y)
+
+            if frame is not None:
+                if timing is not None:
+                    frame = dict(frame, **self._get_latency_fields(timing))
+
+                broadcaster.publish(frame)
+                self.stats.record_sent(frame_bytes(frame))
+
+            return
 
-        print("init succeed!")
-        
         while True:
-            frame_start_time = time.time()
-            
-            if self.use_dynamic_resolution:
-                self.adjust_image_size(render_time)
+            with self._flow_lock:
+                if self._flow_window.is_full():
+                    if self._pending_frame is not None:
+                        self.replaced_frames += 1
+
+                    self._pending_frame = (socketio, frame, timing)
+                    return
+
+                if self._send_frame(socketio, frame, timing):
+                    return
+
+            # another frame was sent while this delta was encoded, diff it again against that one
+            frame = self._encode_frame(frame.image, frame.padding_x, frame.padding_y)
+
+    def _get_latency_fields(self, timing: Dict) -> Dict:
+        stamp: InputStamp = timing["stamp"]
+        now = time.time()
+
+        # only the first frame reflecting an input counts toward its latency
+        if (stamp.sid, stamp.input_id) != self._last_emitted_input:
+            self._last_emitted_input = (stamp.sid, stamp.input_id)
+            self.stats.record_latency("server", now - stamp.receive_time)
+
+        def ms(start, end):
+            return round((end - start) * 1000.0, 3)
+
+        return {
+            "input_id":      stamp.input_id,
+            "input_time":    stamp.client_time,
+            "input_sid":     stamp.sid,
+            # server clock durations in ms, so no clock sync with the client is needed
+            "server_timing": {
+                "queue":  ms(stamp.receive_time, timing["render_start"]),
+                "render": ms(timing["render_start"], timing["render_end"]),
+                "encode": ms(timing["render_end"], timing["encoded"]),
+                "send":   ms(timing["encoded"], now),
+            },
+        }
+
+    def _send_frame(self, socketio, frame, timing: Optional[Dict] = None) -> bool:
+        # must be called with _flow_lock held; False if a delta frame went stale and was not sent
+        if isinstance(frame, _EncodedDelta):
+            frame = self._commit_delta_frame(frame)
+            if frame is _STALE:
+                return False
+
+        if frame is None:
+            return True
+
+        seq = self._frame_seq
+        self._frame_seq += 1
+
+        self._flow_window.sent(seq)
+        num_bytes = frame_bytes(frame)
+        self.stats.record_sent(num_bytes)
+
+        data = dict(frame, seq=seq)
+        if timing is not None:
+            data.update(self._get_latency_fields(timing))
+
+        # 使用room参数指定接收者
+        if self._sid is not None:
+            socketio.emit('draw_response', data, room=self._sid)
+        else:
+            socketio.emit('draw_response', data)
+
+        bandwidth = self._bandwidth
+        if bandwidth is not None:
+            bandwidth.sent(seq, num_bytes, time.time())
+
+        return True
+
+    def _on_frame_ack(self, seq: int, decode_time: Optional[float] = None, sid: Optional[str] = None):
+        broadcaster = self._broadcaster
+        if broadcaster is not None:
+            broadcaster.ack(sid, seq, decode_time)
+
+        with self._flow_lock:
+            if broadcaster is None:
+                self._flow_window.ack(seq, decode_time)
+
+                bandwidth = self._bandwidth
+                if bandwidth is not None:
+                    bandwidth.acked(seq, decode_time, time.time())
+
+                if not self._flush_pending_frame():
+                    self._render_deferred = True
+
+            render_deferred, self._render_deferred = self._render_deferred, False
 
-            current_image_width = self.image_width
-            current_image_height = self.image_height
+        if render_deferred:
+            self.request_redraw()
+
+    def start(self, socketio, render_func):
+        try:
+            # wait for canvas init
+            if not self._wait_for_canvas():
+                return
+
+            print("init succeed!")
+
+            while self._wait_for_redraw():
+                delay = self.render_frame(socketio, render_func)
+                if delay is None:
+                    break
+
+                self._stop_event.wait(delay)
+        finally:
+            self._finish()
+
+    def _apply_mouse_moves(self):
+        mouse_moves = self._mouse_moves
+        if mouse_moves is None:
+            return
 
-            if self.force_fix_aspect_ratio:
-                max_pixel = max(
-                    current_image_height,
-                    current_image_width * self.canvas_aspect_ratio,
+        with self._mouse_lock:
+            move = mouse_moves.take()
+            if move is None:
+                return
+
+            self.x      = move.x
+            self.y      = move.y
+            self.last_x = move.last_x
+            self.last_y = move.last_y
+            self.mouse_samples = move.samples
+
+            try:
+                self._mouse_move_handler(self)
+            except Exception:
+                # a failing handler must not take the render loop down with it
+                traceback.print_exc()
+
+    def _timed_stage(self, stage: str, pixels: int, func: Callable, feed_resolution: bool = True) -> Callable:
+        def run(*args):
+            start_time = time.time()
+            result = func(*args)
+            stage_time = time.time() - start_time
+
+            self.stats.record_stage(stage, stage_time)
+            if feed_resolution:
+                self.resolution_controller.record(stage, stage_time, pixels)
+
+            return result
+
+        return run
+
+    def _get_padding(self, width: int, height: int) -> Tuple[int, int]:
+        if not self.force_fix_aspect_ratio:
+            return 0, 0
+
+        max_pixel = max(height, width * self.canvas_aspect_ratio)
+
+        return (max(0, int((max_pixel / self.canvas_aspect_ratio - width) / 2)),
+                max(0, int((max_pixel - height) / 2)))
+
+    def render_frame(self, socketio, render_func) -> Optional[float]:
+        # renders and sends one frame, returns the delay until the next one is due
+        # or None if the render function is not implemented
+        frame_start_time = time.time()
+
+        if self._is_flow_window_full():
+            # the client is still decoding, rendering now would only produce a stale frame
+            self._render_deferred = True
+            self.stats.count_frame("deferred")
+
+            # keep the redraw request so the frame is retried after the delay, as
+            # _on_frame_ack never runs if the ack is lost and the window only frees
+            # the slot once the frame's ack timed out
+            with self._redraw_cond:
+                self._redraw_requested = True
+
+            return self.frame_interval
+
+        self._apply_mouse_moves()
+        self._adapt_to_bandwidth()
+        input_stamp = self._input_stamp
+
+        refining = self.progressive_refinement and not self.is_interacting()
+
+        if refining:
+            if self._is_refined():
+                return self.frame_interval
+
+            if self._interactive_size is None:
+                self._interactive_size = (self.image_width, self.image_height)
+
+            self.image_width, self.image_height = self._get_refined_size(self._refinement_step)
+            self._refinement_step += 1
+        else:
+            if self._interactive_size is not None:
+                self.image_width, self.image_height = self._interactive_size
+                self._interactive_size = None
+
+            if self.use_dynamic_resolution:
+                self.adjust_image_size()
+
+        current_image_width = self.image_width
+        current_image_height = self.image_height
+
+        buffer_pool = self._buffer_pool
+        pixels = current_image_width * current_image_height
+        render_start_time = time.time()
+
+        try:
+            if buffer_pool is not None:
+                image = render_func(
+                    width   = current_image_width,
+                    height  = current_image_height,
+                    session = self,
+                    out     = buffer_pool.acquire(current_image_width, current_image_height),
                 )
-                
-                padding_x = max(0, int((max_pixel / self.canvas_aspect_ratio - current_image_width) / 2))
-                padding_y = max(0, int((max_pixel - current_image_height) / 2))
             else:
-                padding_x = 0
-                padding_y = 0
+                image = render_func(width=current_image_width, height=current_image_height, session=self)
+        except NotImplementedError as e:
+            return None
 
-            if current_image_width is not None and current_image_height is not None:
-                try:
-                    image = render_func(width=current_image_width, height=current_image_height, session=self)
-                except NotImplementedError as e:
-                    break
-                
-                if image is not None:
-                    self.padding_x = padding_x
-                    self.padding_y = padding_y
-                    
-                    if padding_x > 0 or padding_y > 0:
-                        image = np.pad(image, ((padding_y, padding_y), (padding_x, padding_x), (0, 0)), 'constant', constant_values=0)
-
-                    _, buf = cv2.imencode('.jpg', image)
-                    img_data = buf.tobytes()
-                    # 使用room参数指定接收者
-                    if self._sid is not None:
-                        socketio.emit('draw_response', img_data, room=self._sid)
-                    else:
-                        socketio.emit('draw_response', img_data)
+        if image is None:
+            self.request_redraw()
+            return 0.1
+
+        render_end_time = time.time()
+        render_stage_time = render_end_time - render_start_time
+        self.stats.record_stage("render", render_stage_time)
+        self.stats.count_frame("rendered")
+
+        if image is not UNCHANGED:
+            image = as_image(image, current_image_width, current_image_height)
+
+            # a frame source may still deliver the size it was asked for before
+            current_image_height, current_image_width = image.shape[:2]
+            pixels = current_image_width * current_image_height
+
+        # refined frames say nothing about the interactive frame rate
+        if not refining:
+            self.resolution_controller.record("render", render_stage_time, pixels)
+
+        if image is UNCHANGED:
+            self.stats.count_frame("unchanged")
+        else:
+            self._collect_calibration_frame(image)
+
+            padding_x, padding_y = self._get_padding(current_image_width, current_image_height)
+            self.padding_x  = padding_x
+            self.padding_y  = padding_y
+            self.frame_size = (current_image_width, current_image_height)
+
+            if self.skip_unchanged_frames:
+                image_hash = frame_fingerprint(image, self.fingerprint_stride, (padding_x, padding_y))
+            else:
+                image_hash = None
+
+            if image_hash is not None and image_hash == self.last_image_hash:
+                self.stats.count_frame("unchanged")
+            else:
+                self.last_image_hash = image_hash
+
+                encode_func = functools.partial(self._encode_frame, image, padding_x, padding_y)
+                if input_stamp is not None:
+                    timing = {"stamp": input_stamp, "render_start": render_start_time, "render_end": render_end_time}
+                else:
+                    timing = None
 
+                emit_func = functools.partial(self._emit_frame, socketio, timing=timing)
+
+                encode_func = self._timed_stage("encode", pixels, encode_func, not refining)
+                emit_func = self._timed_stage("emit", pixels, emit_func, not refining)
+
+                pipeline = self._pipeline
+                if pipeline is not None:
+                    if not pipeline.submit(encode_func, emit_func):
+                        # the frame was dropped, so the same picture must not count as
+                        # unchanged next time or the client keeps the older one
+                        self.last_image_hash = None
+                        with self._redraw_cond:
+                            self._redraw_requested = True
                 else:
-                    time.sleep(0.1)
-                    render_time = 0
-                    continue
+                    emit_func(encode_func())
+
+        render_time = time.time() - frame_start_time
+        frame_interval = max(self.frame_interval, self.get_client_frame_time())
+        delay = max(0, frame_interval - render_time)
+
+        if self.progressive_refinement and not self._is_refined():
+            # come back for the refinement once the interaction is over
+            with self._redraw_cond:
+                self._redraw_requested = True
+
+            delay = max(delay, self._last_interaction_time + self.refinement_delay - time.time())
 
-            render_time = time.time() - frame_start_time
-            sleep_time = max(0, self.frame_interval - render_time)
-            time.sleep(sleep_time)
+        return delay
 
 
 class BaseWebViewer(ABC):
@@ -314,9 +1145,36 @@ class BaseWebViewer(ABC):
         self._sessions = dict()
         self._shared_session: Session = None
 
+        self._render_pool: Optional[RenderWorkerPool] = None
+        self._render_workers       = None
+        self._session_join_timeout = 1.0
+
+        self._process_rendering = None
+        self._process_render_pool: Optional[ProcessRenderPool] = None
+        self._frame_source: Optional[SharedMemoryFrameSource] = None
+        self._batch_rendering = None
+        self._batch_scheduler: Optional[BatchRenderScheduler] = None
+
+        self._pipelined            = False
+        self._encode_workers       = None
+        self._pipeline_queue_depth = 2
+        self._pipeline_drop_policy = "drop_oldest"
+        self._encode_executor: Optional[ThreadPoolExecutor] = None
+
         self._target_fps = 60
 
         self._force_fix_aspect_ratio = True
+        self._skip_unchanged_frames  = True
+        self._fingerprint_stride     = 1
+        self._render_on_demand       = False
+        self._max_frames_in_flight   = 2
+        self._delta_frames           = None
+        self._lossless_frames        = None
+        self._progressive_refinement = None
+        self._mouse_move_coalescing  = None
+        self._encoder                = None
+        self._encoder_calibration    = None
+        self._bandwidth_adaptation   = None
         self._use_dynamic_resolution = True
         self._min_pixel              = None
         self._max_pixel              = None
@@ -325,6 +1183,10 @@ class BaseWebViewer(ABC):
         @self._app.route('/')
         def index():
             return render_template('index.html')
+
+        @self._app.route('/metrics')
+        def metrics():
+            return Response(self.get_metrics(), mimetype='text/plain; version=0.0.4')
         
     def set_target_fps(self, fps: float):
         self._target_fps = fps
@@ -334,6 +1196,153 @@ class BaseWebViewer(ABC):
     
     def set_force_fix_aspect_ratio(self, is_force_fix_aspect_ratio: bool):
         self._force_fix_aspect_ratio = is_force_fix_aspect_ratio
+
+    def set_frame_change_detection(self, enabled: bool, stride: int = 1):
+        self._skip_unchanged_frames = enabled
+        self._fingerprint_stride    = stride
+
+    def set_render_on_demand(self, enabled: bool):
+        self._render_on_demand = enabled
+
+    def set_max_frames_in_flight(self, max_frames_in_flight: Optional[int]):
+        self._max_frames_in_flight = max_frames_in_flight
+
+    def set_delta_frames(
+            self,
+            enabled:           bool,
+            tile_size:         int   = 64,
+            keyframe_interval: int   = 120,
+            max_changed_ratio: float = 0.5,
+        ):
+        if enabled:
+            self._delta_frames = (tile_size, keyframe_interval, max_changed_ratio)
+        else:
+            self._delta_frames = None
+
+    def set_lossless_frames(
+            self,
+            enabled:           bool,
+            keyframe_interval: int = 120,
+            mode:              str = "xor",
+            level:             int = 1,
+        ):
+        # lossless zlib frames, residuals against the previous frame per client;
+        # a shared session sends every frame as a zlib keyframe instead
+        if enabled:
+            self._lossless_frames = (keyframe_interval, mode, level)
+        else:
+            self._lossless_frames = None
+
+    def set_progressive_refinement(self, enabled: bool, delay: float = 0.3, steps: int = 1):
+        if enabled:
+            self._progressive_refinement = (delay, steps)
+        else:
+            self._progressive_refinement = None
+
+    def set_encoder(self, encoder: Union[str, FrameEncoder], **options):
+        # the frame format of every session, e.g. set_encoder("webp", quality=80);
+        # a session can still switch with session.set_encoder()
+        create_encoder(encoder, **options)
+        self._encoder = (encoder, options)
+
+    def set_encoder_calibration(
+            self,
+            enabled:    bool,
+            max_bytes:  Optional[int] = None,
+            candidates: Optional[Sequence] = None,
+            num_frames: int = 5,
+        ):
+        # every session benchmarks the candidate encoders on its first frames and keeps
+        # the fastest one whose frames fit max_bytes, see encoders.calibrate_encoders
+        if enabled:
+            self._encoder_calibration = (max_bytes, candidates, num_frames)
+        else:
+            self._encoder_calibration = None
+
+    def set_bandwidth_adaptation(self, enabled: bool, **options):
+        # per client sessions turn encoder quality, then resolution, down to what the link
+        # carries; options go to bandwidth.QualityController, e.g. min_quality=40
+        if enabled:
+            QualityController(**options)
+            self._bandwidth_adaptation = options
+        else:
+            self._bandwidth_adaptation = None
+
+    def set_mouse_move_coalescing(self, enabled: bool, keep_samples: bool = False):
+        # on_mouse_move then runs at most once per rendered frame on the render thread,
+        # with the latest position and the delta accumulated since the previous frame;
+        # keep_samples also collects every position in session.mouse_samples
+        if enabled:
+            self._mouse_move_coalescing = (keep_samples,)
+        else:
+            self._mouse_move_coalescing = None
+
+    def set_render_workers(self, num_workers: int):
+        if not isinstance(num_workers, int) or num_workers < 1:
+            raise ValueError("num_workers must be an integer greater than or equal to 1")
+
+        self._render_workers = num_workers
+
+    def set_process_rendering(
+            self,
+            renderer_factory: Optional[Callable[[], Any]],
+            num_processes:    Optional[int] = None,
+            state_fields:     Sequence[str] = (),
+        ):
+        # renders in worker processes: each builds its renderer with renderer_factory()
+        # (picklable, e.g. a class defined at module level) and gets a SessionSnapshot
+        # per frame; state_fields names extra session attributes to snapshot.
+        # Pass None to render in this process again.
+        if renderer_factory is None:
+            self._process_rendering = None
+            return
+
+        if num_processes is not None and (not isinstance(num_processes, int) or num_processes < 1):
+            raise ValueError("num_processes must be an integer greater than or equal to 1")
+
+        self._process_rendering = (renderer_factory, num_processes, tuple(state_fields))
+
+    def set_batch_rendering(self, window: float = 0.005, max_batch_size: int = 8):
+        # tunes the batching of a viewer that implements render_batch(): requests arriving
+        # within `window` seconds are rendered together, at most max_batch_size per call.
+        # Use at least as many render workers as sessions that should share a batch.
+        if window < 0:
+            raise ValueError("window must be greater than or equal to 0")
+
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError("max_batch_size must be an integer greater than or equal to 1")
+
+        self._batch_rendering = (window, max_batch_size)
+
+    def set_frame_source(self, source: Optional[SharedMemoryFrameSource]):
+        # frames come from an external renderer through shared memory instead of render();
+        # every session gets each new frame, and the producer is asked for the largest
+        # size the sessions want. New frames
+        # arrive without a redraw request, so leave render on demand off.
+        # Pass None to call render() again.
+        if source is not None and not isinstance(source, SharedMemoryFrameSource):
+            raise TypeError("source must be a SharedMemoryFrameSource")
+
+        self._frame_source = source
+
+    def set_pipelined_encoding(
+            self,
+            enabled:        bool,
+            encode_workers: Optional[int] = None,
+            queue_depth:    int           = 2,
+            drop_policy:    str           = "drop_oldest",
+        ):
+        self._pipelined            = enabled
+        self._encode_workers       = encode_workers
+        self._pipeline_queue_depth = queue_depth
+        self._pipeline_drop_policy = drop_policy
+
+    def request_redraw(self):
+        if self._shared_session is not None:
+            self._shared_session.request_redraw()
+
+        for session in list(self._sessions.values()):
+            session.request_redraw()
         
     def set_fixed_resolution(
             self,
@@ -394,6 +1403,39 @@ class BaseWebViewer(ABC):
     
     def render(self, image_width: int, image_height: int, session: Session, **kwargs) -> np.ndarray:
         raise NotImplementedError("Subclasses must implement this method")  
+
+    def render_into(self, out: np.ndarray, session: Session):
+        # opt-in alternative to render(): fill the preallocated `out` (height, width, 3)
+        # and return it, or return UNCHANGED / None like render()
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def render_batch(self, requests: List[RenderRequest]) -> Sequence:
+        # opt-in alternative to render() for renderers that are faster on several views
+        # at once: every request has width, height (the same for all requests of a call),
+        # session and out (a preallocated array or None); return one image, None or
+        # UNCHANGED per request, in order, e.g. an (N, height, width, 3) array
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _uses_render_into(self) -> bool:
+        return type(self).render_into is not BaseWebViewer.render_into
+
+    def _uses_render_batch(self) -> bool:
+        return type(self).render_batch is not BaseWebViewer.render_batch
+
+    def _render_into(self, width: int, height: int, session: Session, out: np.ndarray):
+        return self.render_into(out, session)
+
+    def _get_render_func(self):
+        if self._frame_source is not None:
+            return self._frame_source.render
+
+        if self._process_render_pool is not None:
+            return self._process_render_pool.render
+
+        if self._batch_scheduler is not None:
+            return self._batch_scheduler.render
+
+        return self._render_into if self._uses_render_into() else self.render
     
     def manully_render(self):
         return None
@@ -401,6 +1443,46 @@ class BaseWebViewer(ABC):
     def get_connect_num(self):
         return self._connect_num
 
+    def get_live_session_num(self) -> int:
+        if self._render_pool is None:
+            return 0
+
+        return self._render_pool.get_live_session_num()
+
+    def get_reaped_session_num(self) -> int:
+        if self._render_pool is None:
+            return 0
+
+        return self._render_pool.get_reaped_session_num()
+
+    def _get_labeled_sessions(self) -> List[Tuple[str, Session]]:
+        sessions = [(sid, session) for sid, session in list(self._sessions.items())]
+
+        if self._shared_session is not None:
+            sessions.append(("shared", self._shared_session))
+
+        return sessions
+
+    def get_stats(self) -> Dict:
+        stats = {
+            "live_sessions":   self.get_live_session_num(),
+            "reaped_sessions": self.get_reaped_session_num(),
+            "sessions":        {label: session.get_stats() for label, session in self._get_labeled_sessions()},
+        }
+
+        if self._batch_scheduler is not None:
+            stats["batch_rendering"] = self._batch_scheduler.get_stats()
+
+        return stats
+
+    def get_metrics(self) -> str:
+        # Prometheus text exposition format
+        return format_prometheus(
+            [(label, session.stats, session.get_dropped_frames()) for label, session in self._get_labeled_sessions()],
+            self.get_live_session_num(),
+            self.get_reaped_session_num(),
+        )
+
     def get_current_session(self):
         return self._get_current_session()
 
@@ -409,14 +1491,42 @@ class BaseWebViewer(ABC):
             port:            int  = 5001,
             shared_session:  bool = False,
             manually_render: bool = False,
+            **run_options,
         ):
-
+        # run_options go to SocketIO.run, e.g. allow_unsafe_werkzeug=True
         self._init_routes(shared_session)
 
-        self._socketio.run(self._app, debug=False, host=host, port=port)
+        if self._process_rendering is not None:
+            self._process_render_pool = ProcessRenderPool(*self._process_rendering)
+            self._process_render_pool.start()
+
+        if self._uses_render_batch():
+            self._batch_scheduler = BatchRenderScheduler(self.render_batch, *(self._batch_rendering or ()))
+
+        self._render_pool = RenderWorkerPool(self._socketio, self._get_render_func(), self._render_workers)
+
+        if self._pipelined:
+            self._encode_executor = ThreadPoolExecutor(
+                max_workers        = self._encode_workers,
+                thread_name_prefix = "webviewer-encode",
+            )
+
+        try:
+            self._socketio.run(self._app, debug=False, host=host, port=port, **run_options)
+        finally:
+            self._render_pool.shutdown(self._session_join_timeout)
+
+            if self._process_render_pool is not None:
+                self._process_render_pool.shutdown(self._session_join_timeout)
+                self._process_render_pool = None
+
+            if self._encode_executor is not None:
+                self._encode_executor.shutdown(wait=False)
+                self._encode_executor = None
         
         # reset
         self._shared_session = None
+        self._sessions = dict()
         self._connect_num = 0
 
     # Controls
@@ -556,11 +1666,15 @@ class BaseWebViewer(ABC):
             return self._sessions[request.sid]
     
     def _new_default_session(self, sid):
-        return Session(
+        session = Session(
             width                  = self.image_width,
             height                 = self.image_height,
             sid                    = sid,
             force_fix_aspect_ratio = self._force_fix_aspect_ratio,
+            skip_unchanged_frames  = self._skip_unchanged_frames,
+            fingerprint_stride     = self._fingerprint_stride,
+            render_on_demand       = self._render_on_demand,
+            max_frames_in_flight   = self._max_frames_in_flight,
             use_dynamic_resolution = self._use_dynamic_resolution,
             target_frame_rate      = self._target_fps,
             min_pixel              = self._min_pixel,
@@ -568,6 +1682,102 @@ class BaseWebViewer(ABC):
             adjustment_step        = self._adjustment_step,
         )
 
+        if self._progressive_refinement is not None:
+            session.set_progressive_refinement(True, *self._progressive_refinement)
+
+        if self._encoder is not None:
+            encoder, options = self._encoder
+            if isinstance(encoder, FrameEncoder):
+                # sessions adapt the quality of their encoder in place
+                encoder = encoder.copy()
+            session.set_encoder(encoder, **options)
+
+        if self._encoder_calibration is not None:
+            session.enable_encoder_calibration(*self._encoder_calibration)
+
+        # a shared session serves clients on different links
+        if self._bandwidth_adaptation is not None and sid is not None:
+            session.enable_bandwidth_adaptation(**self._bandwidth_adaptation)
+
+        # a shared session broadcasts full frames, every client may skip ahead differently
+        if self._delta_frames is not None and sid is not None:
+            session.enable_delta_frames(*self._delta_frames)
+
+        if self._lossless_frames is not None:
+            keyframe_interval, mode, level = self._lossless_frames
+            if sid is not None:
+                session.enable_lossless_frames(keyframe_interval, mode, level)
+            else:
+                session.set_encoder("zlib", level=level)
+
+        # render processes and frame sources write into shared memory buffers of their own
+        if self._uses_render_into() and self._process_render_pool is None and self._frame_source is None:
+            session.enable_frame_buffers()
+
+        if self._mouse_move_coalescing is not None:
+            session.enable_mouse_move_coalescing(self.on_mouse_move, *self._mouse_move_coalescing)
+
+        if self._encode_executor is not None:
+            session.enable_pipeline(
+                self._encode_executor,
+                queue_depth = self._pipeline_queue_depth,
+                drop_policy = self._pipeline_drop_policy,
+            )
+
+        return session
+
+    def _apply_mouse_move(self, session: Session, x: int, y: int, last_x: int, last_y: int):
+        if session.queue_mouse_move(x, y, last_x, last_y):
+            return
+
+        session.x = x
+        session.y = y
+        session.last_x = last_x
+        session.last_y = last_y
+
+        self.on_mouse_move(session)
+
+    def _apply_mouse_button(self, session: Session, button: int, pressed: bool):
+        with session._mouse_lock:
+            # a release must not overtake the drag moves queued before it
+            session._apply_mouse_moves()
+
+            if button == 0:
+                session.left_mouse_pressing = pressed
+                if pressed:
+                    self.on_left_mouse_press(session)
+                else:
+                    self.on_left_mouse_release(session)
+            elif button == 2:
+                session.right_mouse_pressing = pressed
+                if pressed:
+                    self.on_right_mouse_press(session)
+                else:
+                    self.on_right_mouse_release(session)
+
+    def _apply_mouse_wheel(self, session: Session, delta):
+        with session._mouse_lock:
+            session._apply_mouse_moves()
+            self.on_mouse_wheel(session, delta)
+
+    def _apply_input(self, session: Session, record: Tuple, sid: Optional[str] = None):
+        kind = record[0]
+
+        if kind == INPUT_STAMP:
+            session.record_input_stamp(record[1], record[2], sid)
+        elif kind == INPUT_MOVE:
+            self._apply_mouse_move(session, *record[1:])
+        elif kind == INPUT_BUTTON:
+            self._apply_mouse_button(session, *record[1:])
+        elif kind == INPUT_WHEEL:
+            self._apply_mouse_wheel(session, record[1])
+        elif kind == INPUT_CONTROL:
+            handler = session._control_handlers.get(record[1])
+            if handler is None:
+                raise ValueError(f"unknown control {record[1]}")
+
+            handler(record[2])
+
     def _init_routes(self, shared_session: bool):
         
         @self._socketio.on('connect')
@@ -582,22 +1792,27 @@ class BaseWebViewer(ABC):
             if shared_session:
                 if self._shared_session is None:
                     session = self._new_default_session(None)
+                    session.enable_broadcast(self._socketio)
                     self._shared_session = session
                     session._set_controls(self._controls, copy=False)
-                    threading.Thread(target=session.start, args=(self._socketio, self.render)).start()
+                    self._render_pool.add(session)
                 else:
                     session = self._shared_session
+
+                # a late joiner is sent the latest frame right away
+                session.add_subscriber(sid)
             else:
                 session = self._new_default_session(sid)
                 session._set_controls(self._controls, copy=True)
                 self._sessions[sid] = session
-                threading.Thread(target=session.start, args=(self._socketio, self.render)).start()
+                self._render_pool.add(session)
 
             htmls = []
             contents = []
             for control_name in session._controls_names:
                 control = session.get_control(control_name)
-                control.set_socketio(self._socketio, sid)
+                control.set_socketio(self._socketio, sid, session.notify_interaction)
+                session._control_handlers.update(control._get_socket_handlers())
                 
                 htmls.append(control.get_html())
                 for content in control._get_content():
@@ -614,15 +1829,42 @@ class BaseWebViewer(ABC):
         def handle_disconnect():
             sid = request.sid
 
-            if sid in self._sessions:
+            if self._shared_session is not None:
+                self._shared_session.remove_subscriber(sid)
+
+            session = self._sessions.pop(sid, None)
+            if session is not None:
                 # leave_room(sid)
-                del self._sessions[sid]
+                session.stop()
+                session.join(self._session_join_timeout)
                 
             self._connect_num -= 1
             
             if self._connect_num < 0:
                 self._connect_num = 0
 
+            if self._connect_num == 0 and self._shared_session is not None:
+                session = self._shared_session
+                self._shared_session = None
+                session.stop()
+                session.join(self._session_join_timeout)
+
+        @self._socketio.on('frame_ack')
+        def handle_frame_ack(data):
+            session = self._get_current_session()
+
+            decode_time = data.get('decode_time')
+            if decode_time is not None:
+                decode_time = float(decode_time) / 1000.0
+
+            session._on_frame_ack(int(data['seq']), decode_time, request.sid)
+
+        @self._socketio.on('latency_report')
+        def handle_latency_report(data):
+            session = self._get_current_session()
+
+            session.record_input_latency(float(data['latency']) / 1000.0)
+
         @self._socketio.on('set_image_size_by_canvas_size')
         def handle_set_image_size_by_canvas_size(data):
             session = self._get_current_session()
@@ -631,6 +1873,8 @@ class BaseWebViewer(ABC):
                 session.image_height = data["height"]
                 session.image_width = data["width"]
                 session.render_aspect_ratio = session.image_height / session.image_width
+
+            session.request_redraw()
         
         @self._socketio.on('send_canvas_size')
         def handle_send_canvas_size(data):
@@ -639,12 +1883,14 @@ class BaseWebViewer(ABC):
             session.canvas_width = data["canvas_width"]
             session.canvas_height = data["canvas_height"]
             session.canvas_aspect_ratio = session.canvas_height / session.canvas_width
+            session.request_redraw()
 
         @self._socketio.on('set_aspect_ratio')
         def handle_set_aspect_ratio(data):
             session = self._get_current_session()
             
             session.canvas_aspect_ratio = data['aspect_ratio']
+            session.request_redraw()
 
             if not session.force_fix_aspect_ratio:
                 session.render_aspect_ratio = session.canvas_aspect_ratio
@@ -666,47 +1912,61 @@ class BaseWebViewer(ABC):
             else:
                 pass
             
+        @self._socketio.on('input')
+        def handle_input(payload):
+            # compact binary channel: a batch of input records in one event
+            session = self._get_current_session()
+
+            # stamps are no input and controls count themselves through on_update
+            events = 0
+            try:
+                for record in decode_input_batch(payload):
+                    self._apply_input(session, record, request.sid)
+                    if record[0] != INPUT_STAMP and record[0] != INPUT_CONTROL:
+                        events += 1
+            finally:
+                session.notify_interaction(events)
+
+        # the separate events below are kept for older clients
+
         @self._socketio.on('on_left_mouse_press')
         def handle_left_mouse_press():
             session = self._get_current_session()
             
-            session.left_mouse_pressing = True
-            self.on_left_mouse_press(session)
+            self._apply_mouse_button(session, 0, True)
+            session.notify_interaction()
 
         @self._socketio.on('on_left_mouse_release')
         def handle_left_mouse_release():
             session = self._get_current_session()
             
-            session.left_mouse_pressing = False
-            self.on_left_mouse_release(session)
+            self._apply_mouse_button(session, 0, False)
+            session.notify_interaction()
 
         @self._socketio.on('on_right_mouse_press')
         def handle_right_mouse_press():
             session = self._get_current_session()
             
-            session.right_mouse_pressing = True
-            self.on_right_mouse_press(session)
+            self._apply_mouse_button(session, 2, True)
+            session.notify_interaction()
 
         @self._socketio.on('on_right_mouse_release')
         def handle_right_mouse_release():
             session = self._get_current_session()
             
-            session.right_mouse_pressing = False
-            self.on_right_mouse_release(session)
+            self._apply_mouse_button(session, 2, False)
+            session.notify_interaction()
 
         @self._socketio.on('on_mouse_wheel')
         def handle_on_mouse_wheel(data):
             session = self._get_current_session()
             
-            self.on_mouse_wheel(session, data['delta'])
+            self._apply_mouse_wheel(session, data['delta'])
+            session.notify_interaction()
 
         @self._socketio.on('update_mouse_position')
         def handle_udate_mouse_position(data):
             session = self._get_current_session()
-            
-            session.x = data['x']
-            session.y = data['y']
-            session.last_x = data['last_x']
-            session.last_y = data['last_y']
 
-            self.on_mouse_move(session)
+            self._apply_mouse_move(session, data['x'], data['y'], data['last_x'], data['last_y'])
+            session.notify_interaction()
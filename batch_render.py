@@ -0,0 +1,161 @@
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class RenderRequest:
+    """
+    One session's frame in a batch: the size to render, the session and, with
+    frame buffers enabled, the preallocated `out` array to render into.
+    """
+
+    def __init__(self, width: int, height: int, session, out=None):
+        self.width   = width
+        self.height  = height
+        self.session = session
+        self.out     = out
+
+        self._done   = threading.Event()
+        self._result = None
+        self._error: Optional[BaseException] = None
+
+    def _set_result(self, result) -> None:
+        self._result = result
+        self._done.set()
+
+    def _set_error(self, error: BaseException) -> None:
+        self._error = error
+        self._done.set()
+
+    def _get_result(self):
+        self._done.wait()
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+
+class BatchRenderScheduler:
+    """
+    Renders the frames of all sessions through one batched render function.
+
+    The render thread of a session hands its request to the scheduler and waits.
+    The first request of a batch opens a window of `window` seconds; requests
+    arriving within it join the batch, which closes early once it holds
+    `max_batch_size` requests or one from every session that rendered within
+    the last `active_timeout` seconds, so a lone session does not wait at all.
+    The batch is grouped by resolution and render_batch(requests) is called
+    once per group (in chunks of at most `max_batch_size`), with one image,
+    None or UNCHANGED expected back per request. Each result goes back to the
+    waiting render thread, which encodes and sends it like any other frame.
+
+    Batches are rendered one at a time; requests arriving meanwhile form the
+    next batch. Only as many sessions can wait for a batch as there are render
+    threads, so set_render_workers() bounds the batch size too.
+    """
+
+    def __init__(
+            self,
+            render_batch:   Callable[[List[RenderRequest]], Sequence[Any]],
+            window:         float = 0.005,
+            max_batch_size: int   = 8,
+            active_timeout: float = 1.0,
+        ):
+        if window < 0:
+            raise ValueError("window must be greater than or equal to 0")
+
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError("max_batch_size must be an integer greater than or equal to 1")
+
+        self.render_batch   = render_batch
+        self.window         = window
+        self.max_batch_size = max_batch_size
+        self.active_timeout = active_timeout
+
+        self._cond        = threading.Condition()
+        self._render_lock = threading.Lock()
+        self._pending: List[RenderRequest] = []
+        self._collecting  = False
+        self._active: Dict[int, float] = {}  # id(session) -> time of its last request
+
+        self.batches  = 0
+        self.requests = 0
+
+    def render(self, width: int, height: int, session, out=None, **kwargs):
+        request = RenderRequest(width, height, session, out)
+
+        with self._cond:
+            self._pending.append(request)
+
+            now = time.monotonic()
+            self._active[id(session)] = now
+
+            # the first request of a batch collects the others and renders them all
+            leader = not self._collecting
+            if leader:
+                self._collecting = True
+                deadline = now + self.window
+
+                while len(self._pending) < self._get_batch_target(now):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+
+                    self._cond.wait(remaining)
+            elif len(self._pending) >= self._get_batch_target(now):
+                self._cond.notify_all()
+
+        if leader:
+            with self._render_lock:
+                # requests that came in while the previous batch rendered join this one
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                    self._collecting = False
+
+                self._render(batch)
+
+        return request._get_result()
+
+    def get_stats(self) -> Dict:
+        return {
+            "batches":         self.batches,
+            "requests":        self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def _get_batch_target(self, now: float) -> int:
+        # must be called with _cond held
+        for key, last_time in list(self._active.items()):
+            if now - last_time > self.active_timeout:
+                del self._active[key]
+
+        return min(self.max_batch_size, max(1, len(self._active)))
+
+    def _render(self, batch: List[RenderRequest]) -> None:
+        # must be called with _render_lock held
+        groups: Dict[Tuple[int, int], List[RenderRequest]] = collections.defaultdict(list)
+        for request in batch:
+            groups[(request.width, request.height)].append(request)
+
+        for requests in groups.values():
+            for start in range(0, len(requests), self.max_batch_size):
+                self._render_group(requests[start:start + self.max_batch_size])
+
+    def _render_group(self, requests: List[RenderRequest]) -> None:
+        self.batches  += 1
+        self.requests += len(requests)
+
+        try:
+            results = list(self.render_batch(requests))
+            if len(results) != len(requests):
+                raise RuntimeError(f"render_batch returned {len(results)} results for {len(requests)} requests")
+        except BaseException as e:
+            # every session of the group sees the failure, e.g. NotImplementedError stops them
+            for request in requests:
+                request._set_error(e)
+            return
+
+        for request, result in zip(requests, results):
+            request._set_result(result)
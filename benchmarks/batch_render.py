@@ -0,0 +1,132 @@
+"""
+Simulates N viewers sharing a model that costs a fixed overhead per call plus a
+little per view, like a neural renderer on a GPU, and compares one render call
+per frame (serialized, as the model is shared) with BatchRenderScheduler. Reports
+frames per second, mean batch size and frame latency per case as JSON.
+
+    python -m webviewer.benchmarks.batch_render --sessions 1,4,16 --overhead-ms 20 --per-view-ms 2
+"""
+import argparse
+import itertools
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from ..batch_render import BatchRenderScheduler, RenderRequest
+from .common import get_environment, parse_list, parse_resolution, write_results
+
+
+class SyntheticModel:
+    """
+    Sleeps for overhead + per_view * batch size, which releases the GIL like a
+    GPU call, and returns flat frames.
+    """
+
+    def __init__(self, overhead: float, per_view: float):
+        self.overhead = overhead
+        self.per_view = per_view
+
+        self._lock = threading.Lock()
+
+    def render(self, width: int, height: int, session, **kwargs) -> np.ndarray:
+        return self.render_batch([RenderRequest(width, height, session)])[0]
+
+    def render_batch(self, requests: List[RenderRequest]) -> np.ndarray:
+        width, height = requests[0].width, requests[0].height
+
+        with self._lock:
+            time.sleep(self.overhead + self.per_view * len(requests))
+
+        return np.zeros((len(requests), height, width, 3), np.uint8)
+
+
+def _run_sessions(render_func, num_sessions: int, width: int, height: int, duration: float) -> List[float]:
+    latencies: List[List[float]] = [[] for _ in range(num_sessions)]
+    stop_time = time.perf_counter() + duration
+
+    def session_loop(index: int) -> None:
+        while time.perf_counter() < stop_time:
+            start_time = time.perf_counter()
+            render_func(width=width, height=height, session=index)
+            latencies[index].append(time.perf_counter() - start_time)
+
+    threads = [threading.Thread(target=session_loop, args=(i,)) for i in range(num_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return list(itertools.chain.from_iterable(latencies))
+
+
+def run_case(
+        num_sessions:   int,
+        width:          int,
+        height:         int,
+        overhead:       float,
+        per_view:       float,
+        window:         float,
+        max_batch_size: int,
+        duration:       float,
+    ) -> Dict:
+    model = SyntheticModel(overhead, per_view)
+    scheduler = BatchRenderScheduler(model.render_batch, window, max_batch_size)
+
+    result = {
+        "sessions":       num_sessions,
+        "width":          width,
+        "height":         height,
+        "window":         window,
+        "max_batch_size": max_batch_size,
+    }
+
+    for mode, render_func in (("serial", model.render), ("batched", scheduler.render)):
+        latencies = np.array(_run_sessions(render_func, num_sessions, width, height, duration))
+
+        result[mode] = {
+            "fps":        len(latencies) / duration,
+            "latency_ms": 1000.0 * float(np.mean(latencies)),
+            "p95_ms":     1000.0 * float(np.percentile(latencies, 95)),
+        }
+
+    result["batched"].update(scheduler.get_stats())
+    result["speedup"] = result["batched"]["fps"] / result["serial"]["fps"]
+
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="comma separated numbers of concurrent viewers")
+    parser.add_argument("--resolution", default="640x480", help="WIDTHxHEIGHT of every frame")
+    parser.add_argument("--overhead-ms", type=float, default=20.0, help="cost of a render call")
+    parser.add_argument("--per-view-ms", type=float, default=2.0, help="extra cost of every view in a call")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="batching window")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="largest batch per render call")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per case and mode")
+    parser.add_argument("-o", "--output", default=None, help="JSON output path, stdout by default")
+    args = parser.parse_args(argv)
+
+    width, height = parse_resolution(args.resolution)
+
+    results = [
+        run_case(
+            int(num_sessions),
+            width,
+            height,
+            args.overhead_ms / 1000.0,
+            args.per_view_ms / 1000.0,
+            args.window_ms / 1000.0,
+            args.max_batch_size,
+            args.duration,
+        )
+        for num_sessions in parse_list(args.sessions)
+    ]
+
+    write_results({"benchmark": "batch_render", "environment": get_environment(), "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
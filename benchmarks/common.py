@@ -0,0 +1,131 @@
+import json
+import os
+import platform
+import sys
+import threading
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..stats import frame_bytes
+
+
+class FakeSocketIO:
+    """
+    In-process stand-in for flask_socketio.SocketIO that swallows emitted frames
+    and only counts them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.bytes  = 0
+
+    def emit(self, event: str, data=None, room: Optional[str] = None, **kwargs) -> None:
+        if event != 'draw_response':
+            return
+
+        with self._lock:
+            self.frames += 1
+            self.bytes  += frame_bytes(data)
+
+
+def _coords(width: int, height: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.meshgrid(
+        np.linspace(0.0, 1.0, width, dtype=np.float32),
+        np.linspace(0.0, 1.0, height, dtype=np.float32),
+    )
+
+
+def constant_render(frame: int, width: int, height: int) -> np.ndarray:
+    return np.full((height, width, 3), 127, np.uint8)
+
+
+def noise_render(frame: int, width: int, height: int) -> np.ndarray:
+    # worst case for the encoder
+    return np.random.randint(0, 256, (height, width, 3), np.uint8)
+
+
+def gradient_render(frame: int, width: int, height: int) -> np.ndarray:
+    xs, ys = _coords(width, height)
+    phase = frame * 0.05
+
+    image = np.empty((height, width, 3), np.uint8)
+    image[..., 0] = ((xs + phase) % 1.0) * 255
+    image[..., 1] = ys * 255
+    image[..., 2] = ((xs + ys + phase) % 1.0) * 127
+
+    return image
+
+
+def scene_render(frame: int, width: int, height: int) -> np.ndarray:
+    # a flat background with a few moving shapes, close to what a 3D viewer sends
+    image = np.full((height, width, 3), 32, np.uint8)
+    image[height // 2:] = 64
+
+    scale = min(width, height)
+    for i in range(6):
+        angle = frame * 0.03 + i * np.pi / 3
+        center = (
+            int(width / 2 + np.cos(angle) * width * 0.3),
+            int(height / 2 + np.sin(angle) * height * 0.3),
+        )
+        color = (40 * i % 256, 255 - 40 * i, 128)
+        cv2.circle(image, center, max(1, scale // 10), color, -1, cv2.LINE_AA)
+
+    cv2.line(image, (0, frame % height), (width - 1, height - 1 - frame % height), (255, 255, 255), 2, cv2.LINE_AA)
+
+    return image
+
+
+RENDERS: Dict[str, Callable[[int, int, int], np.ndarray]] = {
+    "constant": constant_render,
+    "noise":    noise_render,
+    "gradient": gradient_render,
+    "scene":    scene_render,
+}
+
+
+def make_render_func(name: str) -> Callable:
+    # adapts a synthetic source to the render(width, height, session) signature
+    if name not in RENDERS:
+        raise ValueError(f"render must be one of {sorted(RENDERS)}")
+
+    source = RENDERS[name]
+    counter = [0]
+
+    def render(width: int, height: int, session, **kwargs) -> np.ndarray:
+        counter[0] += 1
+        return source(counter[0], width, height)
+
+    return render
+
+
+def parse_resolution(text: str) -> Tuple[int, int]:
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def parse_list(text: str) -> List[str]:
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def get_environment() -> Dict:
+    return {
+        "python":    sys.version.split()[0],
+        "platform":  platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy":     np.__version__,
+        "opencv":    cv2.__version__,
+    }
+
+
+def write_results(results: Dict, output: Optional[str]) -> None:
+    text = json.dumps(results, indent=2)
+
+    if output is None or output == "-":
+        print(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,140 @@
+"""
+Encodes synthetic frames and packs them into Socket.IO packets the way the
+server does, with a few frames held back as if still queued on the socket, and
+reports per frame as JSON how many bytes were newly allocated on the way (with
+tracemalloc), how many bytes Socket.IO copied and whether a reused output buffer
+was overwritten while its frame was still in flight. Each case runs with fresh
+output buffers for every frame and with the reused buffers of the encoder.
+
+    python -m webviewer.benchmarks.emit_copies --resolutions 1280x720,1920x1080 --encoders jpeg,raw
+"""
+import argparse
+import collections
+import hashlib
+import itertools
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+from socketio import packet
+
+from .. import encoders
+from .common import RENDERS, get_environment, parse_list, parse_resolution, write_results
+
+
+class PacketSink:
+    """
+    Packs emitted frames into Socket.IO packets and keeps the last `in_flight`
+    frames referenced, like the queue of a socket that has not written them yet.
+    """
+
+    def __init__(self, in_flight: int):
+        self._queue = collections.deque()
+        self.in_flight = in_flight
+
+        self.copied_bytes = 0
+        self.corrupted    = 0
+
+    def emit(self, event: str, data: Dict) -> None:
+        pkt = packet.Packet(packet.EVENT, data=[event, data], namespace="/")
+        encoded = pkt.encode()
+        attachments = encoded[1:] if isinstance(encoded, list) else []
+
+        # an attachment that is not the payload object itself was copied
+        self.copied_bytes += sum(len(attachment) for attachment in attachments if attachment is not data["image"])
+
+        self._queue.append((attachments, hashlib.blake2b(data["image"]).digest()))
+        while len(self._queue) > self.in_flight:
+            self._release()
+
+    def flush(self) -> None:
+        while self._queue:
+            self._release()
+
+    def _release(self) -> None:
+        attachments, digest = self._queue.popleft()
+        if attachments and hashlib.blake2b(attachments[0]).digest() != digest:
+            self.corrupted += 1
+
+
+def run_case(
+        render:      str,
+        width:       int,
+        height:      int,
+        encoder:     str,
+        reuse:       bool,
+        frames:      int = 30,
+        in_flight:   int = 2,
+    ) -> Dict:
+    frame_encoder = encoders.create_encoder(encoder)
+    frame_encoder.reuse_buffers = reuse
+
+    images = [RENDERS[render](frame, width, height) for frame in range(frames)]
+    sink = PacketSink(in_flight)
+
+    allocated = []
+    sizes = []
+    start_time = time.perf_counter()
+    tracemalloc.start()
+    try:
+        for image in images:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+
+            data = {"type": "key", "format": frame_encoder.format, "image": frame_encoder.encode(image)}
+            sink.emit("draw_response", data)
+            sizes.append(len(data["image"]))
+            del data
+
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    elapsed = time.perf_counter() - start_time
+
+    sink.flush()
+
+    pool = frame_encoder._buffer_pool
+    return {
+        "render":             render,
+        "width":              width,
+        "height":             height,
+        "encoder":            encoder,
+        "reuse_buffers":      reuse,
+        "frames":             frames,
+        "bytes_per_frame":    float(np.mean(sizes)),
+        # the first frames fill the pool, the steady state is what matters
+        "allocated_bytes":    float(np.mean(allocated[in_flight + 1:] or allocated)),
+        "socketio_copied":    sink.copied_bytes / frames,
+        "buffer_allocations": pool.allocations if pool is not None else None,
+        "corrupted_frames":   sink.corrupted,
+        "frame_ms":           1000.0 * elapsed / frames,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", default="scene", help="comma separated synthetic renders")
+    parser.add_argument("--resolutions", default="1280x720,1920x1080", help="comma separated WIDTHxHEIGHT")
+    parser.add_argument("--encoders", default=",".join(encoders.ENCODERS), help="comma separated encoders")
+    parser.add_argument("--frames", type=int, default=30, help="frames per case")
+    parser.add_argument("--in-flight", type=int, default=2, help="frames held back as still being sent")
+    parser.add_argument("-o", "--output", default=None, help="JSON output path, stdout by default")
+    args = parser.parse_args(argv)
+
+    results: List[Dict] = [
+        run_case(render, width, height, encoder, reuse, args.frames, args.in_flight)
+        for render, (width, height), encoder, reuse in itertools.product(
+            parse_list(args.renders),
+            [parse_resolution(text) for text in parse_list(args.resolutions)],
+            parse_list(args.encoders),
+            (False, True),
+        )
+    ]
+
+    write_results({"benchmark": "emit_copies", "environment": get_environment(), "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
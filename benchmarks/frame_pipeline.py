@@ -0,0 +1,213 @@
+"""
+Drives Session.render_frame with synthetic renders and a fake socketio sink and
+reports throughput, per-stage latency and bytes per frame as JSON. With
+--calibrate it instead reports encode time and size of every candidate encoder
+on the rendered frames and the one calibration would pick.
+
+    python -m webviewer.benchmarks.frame_pipeline --resolutions 640x480,1280x720 -o results.json
+    python -m webviewer.benchmarks.frame_pipeline --calibrate --max-bytes 100000
+"""
+import argparse
+import contextlib
+import itertools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from .. import encoders
+from ..base_viewer import Session
+from ..stats import SessionStats
+from .common import (
+    RENDERS,
+    FakeSocketIO,
+    get_environment,
+    make_render_func,
+    parse_list,
+    parse_resolution,
+    write_results,
+)
+
+
+# "delta" is JPEG tiles on top of keyframes
+ENCODERS = (*encoders.ENCODERS, "delta", "lossless")
+PADDINGS = ("none", "letterbox")
+
+
+def run_case(
+        render:         str,
+        width:          int,
+        height:         int,
+        encoder:        str           = "jpeg",
+        padding:        str           = "none",
+        frames:         int           = 100,
+        warmup:         int           = 10,
+        dynamic:        bool          = False,
+        encode_workers: Optional[int] = None,
+    ) -> Dict:
+    if encoder not in ENCODERS:
+        raise ValueError(f"encoder must be one of {ENCODERS}")
+
+    if padding not in PADDINGS:
+        raise ValueError(f"padding must be one of {PADDINGS}")
+
+    socketio = FakeSocketIO()
+    render_func = make_render_func(render)
+
+    session = Session(
+        width,
+        height,
+        sid                    = "benchmark",
+        min_pixel              = min(64, width, height),
+        max_pixel              = max(width, height),
+        use_dynamic_resolution = dynamic,
+        force_fix_aspect_ratio = padding == "letterbox",
+        max_frames_in_flight   = None,
+    )
+
+    # a wider canvas than the image makes the client draw padding on both sides
+    session.canvas_width  = width * 3 // 2 if padding == "letterbox" else width
+    session.canvas_height = height
+    session.canvas_aspect_ratio = session.canvas_height / session.canvas_width
+
+    if encoder == "delta":
+        session.enable_delta_frames()
+    elif encoder == "lossless":
+        session.enable_lossless_frames()
+    else:
+        session.set_encoder(encoder)
+
+    executor = None
+    if encode_workers:
+        executor = ThreadPoolExecutor(encode_workers, thread_name_prefix="benchmark-encode")
+        session.enable_pipeline(executor, encode_workers=encode_workers)
+
+    try:
+        for _ in range(warmup):
+            session.render_frame(socketio, render_func)
+
+        session.stats = SessionStats(window=max(frames, 1))
+        sent_frames, sent_bytes = socketio.frames, socketio.bytes
+
+        start_time = time.perf_counter()
+        for _ in range(frames):
+            session.render_frame(socketio, render_func)
+
+        if executor is not None:
+            # frames still being encoded count toward the run
+            executor.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - start_time
+    finally:
+        session.disable_pipeline()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    sent_frames = socketio.frames - sent_frames
+    sent_bytes  = socketio.bytes - sent_bytes
+    stats = session.stats.snapshot()
+
+    return {
+        "render":          render,
+        "width":           width,
+        "height":          height,
+        "encoder":         encoder,
+        "padding":         padding,
+        "dynamic":         dynamic,
+        "encode_workers":  encode_workers or 0,
+        "frames":          frames,
+        "elapsed":         elapsed,
+        "render_fps":      frames / elapsed if elapsed > 0 else 0.0,
+        "sent_fps":        sent_frames / elapsed if elapsed > 0 else 0.0,
+        "bytes_per_frame": sent_bytes / sent_frames if sent_frames else 0.0,
+        "final_size":      [session.image_width, session.image_height],
+        "stages":          stats["stages"],
+        "frame_counts":    dict(stats["frames"], **session.get_dropped_frames()),
+    }
+
+
+def calibrate_case(
+        render:    str,
+        width:     int,
+        height:    int,
+        frames:    int           = 10,
+        max_bytes: Optional[int] = None,
+    ) -> Dict:
+    render_func = make_render_func(render)
+    images = [render_func(width=width, height=height, session=None) for _ in range(frames)]
+
+    results = encoders.calibrate_encoders(images)
+    chosen = encoders.choose_encoder(results, max_bytes)
+
+    return {
+        "render":    render,
+        "width":     width,
+        "height":    height,
+        "max_bytes": max_bytes,
+        "chosen":    repr(chosen),
+        "encoders":  [
+            {
+                "format":      result["format"],
+                "options":     result["options"],
+                "encode_time": result["encode_time"],
+                "bytes":       result["bytes"],
+            }
+            for result in results
+        ],
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", default=",".join(RENDERS), help="comma separated synthetic renders")
+    parser.add_argument("--resolutions", default="320x240,640x480,1280x720", help="comma separated WIDTHxHEIGHT")
+    parser.add_argument("--encoders", default=",".join(ENCODERS), help="comma separated encoders")
+    parser.add_argument("--paddings", default=",".join(PADDINGS), help="comma separated padding modes")
+    parser.add_argument("--frames", type=int, default=100, help="measured frames per case")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured frames per case")
+    parser.add_argument("--dynamic", action="store_true", help="let the resolution controller pick the size")
+    parser.add_argument("--encode-workers", type=int, default=0, help="encode on a pipeline with this many threads")
+    parser.add_argument("--calibrate", action="store_true", help="compare the encoders instead of running the pipeline")
+    parser.add_argument("--max-bytes", type=int, default=None, help="frame size budget of the calibration")
+    parser.add_argument("-o", "--output", default=None, help="JSON output path, stdout by default")
+    args = parser.parse_args(argv)
+
+    if args.calibrate:
+        results = [
+            calibrate_case(render, width, height, max(args.frames // 10, 1), args.max_bytes)
+            for render, (width, height) in itertools.product(
+                parse_list(args.renders),
+                [parse_resolution(text) for text in parse_list(args.resolutions)],
+            )
+        ]
+        write_results({"benchmark": "encoder_calibration", "environment": get_environment(), "results": results}, args.output)
+        return
+
+    cases = itertools.product(
+        parse_list(args.renders),
+        [parse_resolution(text) for text in parse_list(args.resolutions)],
+        parse_list(args.encoders),
+        parse_list(args.paddings),
+    )
+
+    results = []
+    # sessions log to stdout, which may be carrying the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for render, (width, height), encoder, padding in cases:
+            results.append(run_case(
+                render,
+                width,
+                height,
+                encoder        = encoder,
+                padding        = padding,
+                frames         = args.frames,
+                warmup         = args.warmup,
+                dynamic        = args.dynamic,
+                encode_workers = args.encode_workers,
+            ))
+
+    write_results({"benchmark": "frame_pipeline", "environment": get_environment(), "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
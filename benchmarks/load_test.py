@@ -0,0 +1,347 @@
+"""
+Starts a BaseWebViewer with a synthetic scene in a child process and connects a
+growing number of simulated browser clients to it with the python-socketio client.
+Each client replays the browser protocol (canvas size, mouse move streams, slider
+events, frame acks) and the run reports per-client FPS, input-to-frame latency and
+the CPU used by the server as JSON.
+
+    python -m webviewer.benchmarks.load_test --clients 1,4,16 --duration 10 -o load.json
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import socketio
+
+from ..base_viewer import BaseWebViewer, Session
+from ..inputs import pack_control, pack_mouse_move, pack_stamp
+from ..stats import frame_bytes
+from .common import RENDERS, get_environment, parse_list, parse_resolution, write_results
+
+
+class SyntheticViewer(BaseWebViewer):
+
+    def __init__(self, render: str = "scene", width: Optional[int] = None, height: Optional[int] = None):
+        super().__init__(width, height)
+
+        self._source = RENDERS[render]
+
+        self.add_slider("speed", "Speed", None, 1.0, 0.0, 4.0, 0.1)
+
+    def render(self, width: int, height: int, session: Session, **kwargs) -> np.ndarray:
+        # mouse moves and the slider both change the picture, like a camera would
+        session.frame = getattr(session, "frame", 0) + session["speed"].value
+        return self._source(int(session.frame + session.x), width, height)
+
+
+def _serve(port: int, render: str, shared_session: bool, render_workers: Optional[int]) -> None:
+    viewer = SyntheticViewer(render)
+    if render_workers:
+        viewer.set_render_workers(render_workers)
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        # stdin of a child process is no TTY, which Flask-SocketIO refuses to serve Werkzeug on otherwise
+        viewer.run(host="127.0.0.1", port=port, shared_session=shared_session, allow_unsafe_werkzeug=True)
+
+
+def _get_cpu_time(pid: int) -> Optional[float]:
+    # user + system time of the whole server process, Linux only
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class SimulatedClient:
+    """
+    One browser tab: sends the canvas size on connect, streams mouse moves at a
+    fixed rate, nudges every slider now and then and acks each frame it receives.
+    Inputs go through the binary input channel unless legacy_input is set.
+    """
+
+    def __init__(
+            self,
+            url:           str,
+            canvas_width:  int   = 800,
+            canvas_height: int   = 600,
+            input_rate:    float = 60.0,
+            slider_period: float = 1.0,
+            decode:        bool  = False,
+            legacy_input:  bool  = False,
+        ):
+        self.url           = url
+        self.canvas_width  = canvas_width
+        self.canvas_height = canvas_height
+        self.input_rate    = input_rate
+        self.slider_period = slider_period
+        self.decode        = decode
+        self.legacy_input  = legacy_input
+
+        self._sio = socketio.Client(reconnection=False)
+        self._sio.on('connect', self._on_connect)
+        self._sio.on('render_controls', self._on_render_controls)
+        self._sio.on('draw_response', self._on_draw_response)
+
+        self._lock = threading.Lock()
+        self._sliders: List[str] = []
+        self._stop_event = threading.Event()
+        self._input_thread: Optional[threading.Thread] = None
+
+        self._measuring       = False
+        self._pending_input   = None
+        self._input_id        = 0
+        self._reported_input  = 0
+        self.frames           = 0
+        self.bytes            = 0
+        self.latencies: List[float] = []
+
+    def connect(self) -> None:
+        self._sio.connect(self.url, wait_timeout=10)
+
+        self._input_thread = threading.Thread(target=self._send_inputs, daemon=True)
+        self._input_thread.start()
+
+    def disconnect(self) -> None:
+        self._stop_event.set()
+        if self._input_thread is not None:
+            self._input_thread.join()
+
+        self._sio.disconnect()
+
+    def start_measuring(self) -> None:
+        with self._lock:
+            self._measuring     = True
+            self._pending_input = None
+            self.frames         = 0
+            self.bytes          = 0
+            self.latencies      = []
+
+    def stop_measuring(self) -> None:
+        with self._lock:
+            self._measuring = False
+
+    def _on_connect(self):
+        self._sio.emit('set_image_size_by_canvas_size', {'width': self.canvas_width, 'height': self.canvas_height})
+        self._sio.emit('send_canvas_size', {'canvas_width': self.canvas_width, 'canvas_height': self.canvas_height})
+
+    def _on_render_controls(self, data):
+        with self._lock:
+            self._sliders = [content['id'] for content in data['contents'] if content.get('type') == 'slider']
+
+    def _on_draw_response(self, data):
+        receive_time = time.perf_counter()
+
+        if self.decode and data.get('image'):
+            cv2.imdecode(np.frombuffer(data['image'], np.uint8), cv2.IMREAD_COLOR)
+
+        with self._lock:
+            if self._measuring:
+                self.frames += 1
+                self.bytes  += frame_bytes(data)
+
+                if self.legacy_input:
+                    # legacy inputs carry no id, so take the oldest input not answered by a frame yet
+                    if self._pending_input is not None:
+                        self.latencies.append(receive_time - self._pending_input)
+                        self._pending_input = None
+
+            # stamped inputs are echoed back with the first frame reflecting them
+            input_id = data.get('input_id')
+            report = input_id is not None and data.get('input_sid') == self._sio.get_sid() and input_id > self._reported_input
+            if report:
+                self._reported_input = input_id
+                latency = time.perf_counter() * 1000.0 - data['input_time']
+                if self._measuring:
+                    self.latencies.append(latency / 1000.0)
+
+        if 'seq' in data:
+            self._sio.emit('frame_ack', {'seq': data['seq'], 'decode_time': (time.perf_counter() - receive_time) * 1000.0})
+
+        if report:
+            self._sio.emit('latency_report', {'input_id': input_id, 'latency': latency, 'server_timing': data.get('server_timing')})
+
+    def _send_inputs(self):
+        interval = 1.0 / self.input_rate
+        last_slider_time = time.perf_counter()
+        x, y = self.canvas_width // 2, self.canvas_height // 2
+        step = 0
+
+        while not self._stop_event.wait(interval):
+            step += 1
+            last_x, last_y = x, y
+            x = int(self.canvas_width / 2 + np.cos(step * 0.05) * self.canvas_width / 4)
+            y = int(self.canvas_height / 2 + np.sin(step * 0.05) * self.canvas_height / 4)
+
+            with self._lock:
+                if self._pending_input is None:
+                    self._pending_input = time.perf_counter()
+                sliders = list(self._sliders)
+
+            controls = []
+            if sliders and time.perf_counter() - last_slider_time > self.slider_period:
+                last_slider_time = time.perf_counter()
+                controls = [(slider_id, {'value': 1.0 + (step % 20) / 10.0}) for slider_id in sliders]
+
+            try:
+                if self.legacy_input:
+                    self._sio.emit('update_mouse_position', {'x': x, 'y': y, 'last_x': last_x, 'last_y': last_y})
+                    for slider_id, data in controls:
+                        self._sio.emit(slider_id, data)
+                else:
+                    self._input_id += 1
+                    batch = pack_stamp(self._input_id, time.perf_counter() * 1000.0)
+                    batch += pack_mouse_move(x, y, last_x, last_y)
+                    batch += b"".join(pack_control(slider_id, data) for slider_id, data in controls)
+                    self._sio.emit('input', batch)
+            except socketio.exceptions.BadNamespaceError:
+                return
+
+
+def run_step(url: str, server_pid: int, num_clients: int, duration: float, warmup: float, **client_options) -> Dict:
+    clients = [SimulatedClient(url, **client_options) for _ in range(num_clients)]
+
+    for client in clients:
+        client.connect()
+
+    try:
+        time.sleep(warmup)
+
+        for client in clients:
+            client.start_measuring()
+
+        start_cpu  = _get_cpu_time(server_pid)
+        start_time = time.perf_counter()
+        time.sleep(duration)
+        elapsed    = time.perf_counter() - start_time
+        end_cpu    = _get_cpu_time(server_pid)
+
+        for client in clients:
+            client.stop_measuring()
+    finally:
+        for client in clients:
+            client.disconnect()
+
+    per_client = []
+    latencies = []
+    for client in clients:
+        latencies.extend(client.latencies)
+        per_client.append({
+            "fps":             client.frames / elapsed,
+            "bytes_per_frame": client.bytes / client.frames if client.frames else 0.0,
+            "latency_p50":     _percentile(client.latencies, 0.50),
+            "latency_p95":     _percentile(client.latencies, 0.95),
+        })
+
+    fps = [client["fps"] for client in per_client]
+
+    if start_cpu is not None and end_cpu is not None:
+        server_cpu = (end_cpu - start_cpu) / elapsed
+    else:
+        server_cpu = None
+
+    return {
+        "clients":     num_clients,
+        "elapsed":     elapsed,
+        "fps_mean":    float(np.mean(fps)),
+        "fps_min":     float(np.min(fps)),
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+        "server_cpu":  server_cpu,  # in cores, 1.0 is one core fully busy
+        "per_client":  per_client,
+    }
+
+
+def _wait_for_server(url: str, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while True:
+        client = socketio.Client(reconnection=False)
+        try:
+            client.connect(url, wait_timeout=2)
+            client.disconnect()
+            return
+        except socketio.exceptions.ConnectionError:
+            if time.time() > deadline:
+                raise RuntimeError(f"server at {url} did not come up in {timeout} seconds")
+
+            time.sleep(0.2)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="1,2,4,8", help="comma separated client counts, run in turn")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds per step")
+    parser.add_argument("--render", default="scene", choices=sorted(RENDERS))
+    parser.add_argument("--canvas", default="800x600", help="WIDTHxHEIGHT of the simulated canvas")
+    parser.add_argument("--input-rate", type=float, default=60.0, help="mouse moves per second per client")
+    parser.add_argument("--decode", action="store_true", help="decode every frame on the client side")
+    parser.add_argument("--legacy-input", action="store_true", help="send one Socket.IO event per input")
+    parser.add_argument("--shared-session", action="store_true", help="run the server with a shared session")
+    parser.add_argument("--render-workers", type=int, default=None, help="size of the server render pool")
+    parser.add_argument("--port", type=int, default=5123)
+    parser.add_argument("-o", "--output", default=None, help="JSON output path, stdout by default")
+    args = parser.parse_args(argv)
+
+    canvas_width, canvas_height = parse_resolution(args.canvas)
+    url = f"http://127.0.0.1:{args.port}"
+
+    server = multiprocessing.Process(
+        target = _serve,
+        args   = (args.port, args.render, args.shared_session, args.render_workers),
+        daemon = True,
+    )
+    server.start()
+
+    results = []
+    try:
+        _wait_for_server(url)
+
+        for num_clients in parse_list(args.clients):
+            results.append(run_step(
+                url,
+                server.pid,
+                int(num_clients),
+                args.duration,
+                args.warmup,
+                canvas_width  = canvas_width,
+                canvas_height = canvas_height,
+                input_rate    = args.input_rate,
+                decode        = args.decode,
+                legacy_input  = args.legacy_input,
+            ))
+            print(f"{num_clients} clients: {results[-1]['fps_mean']:.1f} fps", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.join()
+
+    write_results({
+        "benchmark":      "load_test",
+        "environment":    get_environment(),
+        "render":         args.render,
+        "canvas":         [canvas_width, canvas_height],
+        "shared_session": args.shared_session,
+        "results":        results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
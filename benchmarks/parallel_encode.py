@@ -0,0 +1,102 @@
+"""
+Encodes synthetic frames with ParallelJpegEncoder on thread pools of growing size
+and reports encode time, speedup over a single cv2.imencode call and the size
+overhead of the restart markers as JSON.
+
+    python -m webviewer.benchmarks.parallel_encode --resolutions 1920x1080,3840x2160 --workers 1,2,4,8
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..encoders import JpegEncoder, ParallelJpegEncoder
+from .common import RENDERS, get_environment, parse_list, parse_resolution, write_results
+
+
+def _time_encoder(encoder, images: List[np.ndarray], repeat: int) -> Dict:
+    # the first call pays for lazy initialization inside the codec and the pool
+    encoder.encode(images[0])
+
+    times = []
+    sizes = []
+    for _ in range(repeat):
+        for image in images:
+            start_time = time.perf_counter()
+            sizes.append(len(encoder.encode(image)))
+            times.append(time.perf_counter() - start_time)
+
+    times.sort()
+    return {
+        "encode_ms": 1000.0 * sum(times) / len(times),
+        "p95_ms":    1000.0 * times[min(len(times) - 1, int(0.95 * len(times)))],
+        "bytes":     float(np.mean(sizes)),
+    }
+
+
+def run_case(
+        render:  str,
+        width:   int,
+        height:  int,
+        workers: List[int],
+        quality: Optional[int] = None,
+        frames:  int           = 5,
+        repeat:  int           = 4,
+    ) -> Dict:
+    images = [RENDERS[render](frame, width, height) for frame in range(frames)]
+
+    baseline = _time_encoder(JpegEncoder(quality), images, repeat)
+
+    scaling = []
+    for num_workers in workers:
+        with ThreadPoolExecutor(num_workers, thread_name_prefix="benchmark-jpeg") as executor:
+            encoder = ParallelJpegEncoder(quality, strips=num_workers, executor=executor)
+            result = _time_encoder(encoder, images, repeat)
+
+        result["workers"]  = num_workers
+        result["speedup"]  = baseline["encode_ms"] / result["encode_ms"]
+        result["overhead"] = result["bytes"] / baseline["bytes"] - 1.0
+        scaling.append(result)
+
+    return {
+        "render":   render,
+        "width":    width,
+        "height":   height,
+        "quality":  quality,
+        "baseline": baseline,
+        "scaling":  scaling,
+    }
+
+
+def main(argv=None) -> None:
+    default_workers = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", default="scene,gradient,noise", help="comma separated synthetic renders")
+    parser.add_argument("--resolutions", default="1920x1080,2560x1440,3840x2160", help="comma separated WIDTHxHEIGHT")
+    parser.add_argument("--workers", default=",".join(map(str, default_workers)), help="comma separated pool sizes")
+    parser.add_argument("--quality", type=int, default=None, help="JPEG quality, OpenCV's default if not given")
+    parser.add_argument("--frames", type=int, default=5, help="distinct frames per case")
+    parser.add_argument("--repeat", type=int, default=4, help="times every frame is encoded")
+    parser.add_argument("-o", "--output", default=None, help="JSON output path, stdout by default")
+    args = parser.parse_args(argv)
+
+    workers = [int(num_workers) for num_workers in parse_list(args.workers)]
+
+    results = [
+        run_case(render, width, height, workers, args.quality, args.frames, args.repeat)
+        for render, (width, height) in itertools.product(
+            parse_list(args.renders),
+            [parse_resolution(text) for text in parse_list(args.resolutions)],
+        )
+    ]
+
+    write_results({"benchmark": "parallel_encode", "environment": get_environment(), "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
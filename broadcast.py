@@ -0,0 +1,111 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from .flow import FlowWindow
+
+
+class _Subscriber:
+
+    def __init__(self, window: FlowWindow):
+        self.window        = window
+        self.last_sent_seq = -1
+
+
+class FrameBroadcaster:
+    """
+    Fan-out of the frames of a shared session. Every frame is rendered and encoded
+    once and only the newest one is kept; each subscriber gets it whenever its
+    flow window has room, skipping the frames it fell behind on. A late joiner
+    is sent the newest frame right away.
+    """
+
+    def __init__(
+            self,
+            socketio,
+            max_frames_in_flight: Optional[int] = 2,
+            ack_timeout:          float         = 2.0,
+        ):
+        self._socketio = socketio
+
+        self.max_frames_in_flight = max_frames_in_flight
+        self.ack_timeout          = ack_timeout
+
+        self._lock = threading.Lock()
+        self._latest: Optional[Tuple[int, Dict]] = None
+        self._subscribers: Dict[str, _Subscriber] = {}
+        self._seq  = 0
+
+        self.skipped_frames = 0
+
+    def subscribe(self, sid: str) -> None:
+        with self._lock:
+            subscriber = _Subscriber(FlowWindow(self.max_frames_in_flight, self.ack_timeout))
+            self._subscribers[sid] = subscriber
+
+            if self._latest is not None:
+                self._send(sid, subscriber, *self._latest)
+
+    def unsubscribe(self, sid: str) -> None:
+        with self._lock:
+            self._subscribers.pop(sid, None)
+
+    def get_subscriber_num(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def set_max_frames_in_flight(self, max_frames_in_flight: Optional[int]) -> None:
+        with self._lock:
+            self.max_frames_in_flight = max_frames_in_flight
+
+            for subscriber in self._subscribers.values():
+                subscriber.window.max_frames_in_flight = max_frames_in_flight
+
+    def publish(self, frame: Dict) -> int:
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+
+            data = dict(frame, seq=seq)
+            self._latest = (seq, data)
+
+            for sid, subscriber in self._subscribers.items():
+                if not subscriber.window.is_full():
+                    self._send(sid, subscriber, seq, data)
+
+            return seq
+
+    def ack(self, sid: str, seq: int, decode_time: Optional[float] = None) -> None:
+        with self._lock:
+            subscriber = self._subscribers.get(sid)
+            if subscriber is None:
+                return
+
+            subscriber.window.ack(seq, decode_time)
+
+            if self._latest is not None and not subscriber.window.is_full():
+                latest_seq, data = self._latest
+                if latest_seq > subscriber.last_sent_seq:
+                    self._send(sid, subscriber, latest_seq, data)
+
+    def is_congested(self) -> bool:
+        # rendering is pointless while no subscriber can take a new frame
+        with self._lock:
+            return all(subscriber.window.is_full() for subscriber in self._subscribers.values())
+
+    def get_frame_time(self) -> float:
+        # slower clients skip frames, so the fastest one sets the pace
+        with self._lock:
+            if not self._subscribers:
+                return 0.0
+
+            return min(subscriber.window.frame_time for subscriber in self._subscribers.values())
+
+    def _send(self, sid: str, subscriber: _Subscriber, seq: int, data: Dict) -> None:
+        # must be called with _lock held
+        if subscriber.last_sent_seq >= 0:
+            self.skipped_frames += max(0, seq - subscriber.last_sent_seq - 1)
+
+        subscriber.last_sent_seq = seq
+        subscriber.window.sent(seq)
+
+        self._socketio.emit('draw_response', data, room=sid)
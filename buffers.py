@@ -0,0 +1,138 @@
+import sys
+import threading
+import numpy as np
+from typing import List, Optional, Tuple, Union
+
+
+def _measure_free_refcount() -> int:
+    # reference count of a pooled buffer nobody else holds, measured the same way acquire() does
+    buffers = [np.empty(1)]
+    for buffer in buffers:
+        return sys.getrefcount(buffer)
+
+
+_FREE_REFCOUNT = _measure_free_refcount()
+
+
+class FrameBufferPool:
+    """
+    Preallocated output buffers for render_into(), reused while the resolution
+    stays the same. A buffer is handed out again only once nothing outside the
+    pool references it any more (including views and frames still waiting in
+    the encode pipeline), so frames that are dropped free their buffer implicitly.
+    """
+
+    def __init__(
+            self,
+            channels:    int = 3,
+            dtype              = np.uint8,
+            max_buffers: int = 4,
+        ):
+        if not isinstance(channels, int) or channels < 1:
+            raise ValueError("channels must be an integer greater than or equal to 1")
+
+        if not isinstance(max_buffers, int) or max_buffers < 1:
+            raise ValueError("max_buffers must be an integer greater than or equal to 1")
+
+        self.channels    = channels
+        self.dtype       = np.dtype(dtype)
+        self.max_buffers = max_buffers
+
+        self._lock    = threading.Lock()
+        self._shape: Optional[Tuple[int, int, int]] = None
+        self._buffers: List[np.ndarray] = []
+
+        self.allocations = 0
+
+    def acquire(self, width: int, height: int) -> np.ndarray:
+        shape = (height, width, self.channels)
+
+        with self._lock:
+            if shape != self._shape:
+                # the resolution changed, buffers of the old size are recycled
+                self._shape   = shape
+                self._buffers = []
+
+            for buffer in self._buffers:
+                if sys.getrefcount(buffer) <= _FREE_REFCOUNT:
+                    return buffer
+
+            buffer = self._allocate(shape)
+            self.allocations += 1
+
+            if len(self._buffers) < self.max_buffers:
+                self._buffers.append(buffer)
+
+            return buffer
+
+    def _allocate(self, shape: Tuple[int, int, int]) -> np.ndarray:
+        return np.empty(shape, self.dtype)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._shape   = None
+            self._buffers = []
+
+
+class ByteBufferPool:
+    """
+    Reused bytearrays for encoded frames. Socket.IO sends bytes and bytearray
+    attachments as they are, so a frame encoded into a pooled bytearray reaches
+    the transport without another copy. Like FrameBufferPool, a buffer is handed
+    out again only once nothing else references it, that is once the frame has
+    been written to the socket and dropped by every queue and ring holding it.
+    """
+
+    def __init__(self, max_buffers: int = 8, headroom: float = 0.25):
+        if not isinstance(max_buffers, int) or max_buffers < 1:
+            raise ValueError("max_buffers must be an integer greater than or equal to 1")
+
+        self.max_buffers = max_buffers
+        self.headroom    = headroom
+
+        self._lock    = threading.Lock()
+        self._buffers: List[bytearray] = []
+
+        self.allocations = 0
+
+    def acquire(self, size: int) -> bytearray:
+        # a bytearray of exactly `size` bytes with undefined contents
+        with self._lock:
+            for buffer in self._buffers:
+                if sys.getrefcount(buffer) <= _FREE_REFCOUNT:
+                    break
+            else:
+                buffer = bytearray()
+                if len(self._buffers) < self.max_buffers:
+                    self._buffers.append(buffer)
+
+            capacity = buffer.__alloc__()
+            if size > len(buffer):
+                # grow with some headroom, trimming the length afterwards keeps the allocation
+                grown = size if size < capacity else int(size * (1.0 + self.headroom))
+                buffer.extend(bytes(grown - len(buffer)))
+
+            # CPython only reallocates a bytearray shrinking below half its allocation
+            del buffer[size:]
+
+            if buffer.__alloc__() != capacity:
+                self.allocations += 1
+
+            return buffer
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buffers = []
+
+
+def as_image(
+        image:  Union[np.ndarray, bytes, bytearray, memoryview],
+        width:  int,
+        height: int,
+        dtype        = np.uint8,
+    ) -> np.ndarray:
+    # raw pixel buffers are wrapped without copying
+    if isinstance(image, np.ndarray):
+        return image
+
+    return np.frombuffer(image, dtype).reshape(height, width, -1)
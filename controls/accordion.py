@@ -119,12 +119,27 @@ class Accordion(BasicControl):
             self.expanded = expanded
 
 
-    def set_socketio(self, socketio: SocketIO, sid: str) -> None:
-        super().set_socketio(socketio, sid)
+    def set_socketio(self,
+                     socketio:  SocketIO,
+                     sid:       str,
+                     on_update: Optional[Callable[[], None]] = None,
+                     ) -> None:
+        super().set_socketio(socketio, sid, on_update)
 
         for control_name in self.nested_controls_names:
             control = self.nested_controls[control_name]
-            control.set_socketio(socketio, sid)
+            control.set_socketio(socketio, sid, on_update)
+
+    def _get_nested_controls(self) -> Dict[str, BasicControl]:
+        return dict(self.nested_controls)
+
+    def _get_socket_handlers(self) -> Dict[str, Callable[[Dict], None]]:
+        handlers = super()._get_socket_handlers()
+
+        for control_name in self.nested_controls_names:
+            handlers.update(self.nested_controls[control_name]._get_socket_handlers())
+
+        return handlers
 
     def _get_content(self) -> List[Dict]:
         basic_content = {
@@ -32,6 +32,8 @@ class BasicControl:
         self._callback = callback
         
         self._id = self._type + "_" + random_string(RANDOM_ID_LENGTH)
+
+        self._socket_handler: Optional[Callable[[Dict], None]] = None
         
     def get_id(self):
         return self._id
@@ -63,13 +65,22 @@ class BasicControl:
     def get_callback(self) -> Optional[Callable[[Dict], None]]:
         return self._callback
     
-    def set_socketio(self, socketio: SocketIO, sid: str) -> None:
+    def set_socketio(self,
+                     socketio:  SocketIO,
+                     sid:       str,
+                     on_update: Optional[Callable[[], None]] = None,
+                     ) -> None:
         raw_update_func = copy.copy(self.update)  # for avoiding the hook
         @socketio.on(self._id)
         def handle(data):
             raw_update_func(**data)
             if self._callback is not None:
                 self._callback(self)
+            if on_update is not None:
+                on_update()
+
+        # also reachable through the binary input channel
+        self._socket_handler = handle
         
         def _wrap_with_hook(method):
             def wrapper(*args, **kwargs):
@@ -86,6 +97,17 @@ class BasicControl:
             setattr(self, 'update', hooked_method)
             setattr(self, 'update_without_callback', original_method)
 
+
+    def _get_nested_controls(self) -> Dict[str, "BasicControl"]:
+        # controls reachable through get_control(), by name
+        return {}
+
+    def _get_socket_handlers(self) -> Dict[str, Callable[[Dict], None]]:
+        # event name -> handler, for this control and the controls nested in it
+        if self._socket_handler is None:
+            return {}
+
+        return {self._id: self._socket_handler}
    
     def _get_content(self) -> List[Dict]:
         basic_content = {"id": self._id, "type": self._type}
@@ -123,13 +123,26 @@ class Tab(BasicControl):
             else:
                 self.active_tab = active_tab
         
-    def set_socketio(self, socketio: SocketIO, sid: str) -> None:
-        super().set_socketio(socketio, sid)
+    def set_socketio(self,
+                     socketio:  SocketIO,
+                     sid:       str,
+                     on_update: Optional[Callable[[], None]] = None,
+                     ) -> None:
+        super().set_socketio(socketio, sid, on_update)
 
         for page_name in self.pages.keys():
             for control in self.pages[page_name]["controls"]:
                 # control = self.pages[page_name]["controls"][control_name]
-                control.set_socketio(socketio, sid)
+                control.set_socketio(socketio, sid, on_update)
+
+    def _get_socket_handlers(self) -> Dict[str, Callable[[Dict], None]]:
+        handlers = super()._get_socket_handlers()
+
+        for page_name in self.pages.keys():
+            for control in self.pages[page_name]["controls"]:
+                handlers.update(control._get_socket_handlers())
+
+        return handlers
 
     def _get_content(self) -> List[Dict]:
         if len(self.pages) == 0:
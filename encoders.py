@@ -0,0 +1,461 @@
+import copy
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import cv2
+import numpy as np
+
+from .buffers import ByteBufferPool
+
+
+class FrameEncoder:
+    """
+    Turns a rendered BGR image into the bytes sent to the client. `format` is
+    sent with every frame so the client knows how to decode it.
+
+    Encoders write their output into bytearrays from a ByteBufferPool, which
+    Socket.IO sends without copying. Set `reuse_buffers` to False to get a
+    fresh buffer for every frame.
+    """
+
+    format = None
+
+    reuse_buffers = True
+    _buffer_pool: Optional[ByteBufferPool] = None
+
+    def encode(self, image: np.ndarray) -> Union[bytes, bytearray]:
+        raise NotImplementedError
+
+    def _get_output_buffer(self, size: int) -> bytearray:
+        if not self.reuse_buffers:
+            return bytearray(size)
+
+        if self._buffer_pool is None:
+            self._buffer_pool = ByteBufferPool()
+
+        return self._buffer_pool.acquire(size)
+
+    def _join_output(self, chunks: Sequence) -> bytearray:
+        # the one copy between the codec's own output and the socket
+        out = self._get_output_buffer(sum(len(chunk) for chunk in chunks))
+
+        with memoryview(out) as view:
+            offset = 0
+            for chunk in chunks:
+                view[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+
+        return out
+
+    def get_options(self) -> Dict:
+        return {}
+
+    def copy(self) -> "FrameEncoder":
+        # the same settings with output buffers of its own, e.g. for another session,
+        # so that changing its quality does not change the original
+        encoder = copy.copy(self)
+        encoder._buffer_pool = None
+        return encoder
+
+    def __repr__(self):
+        options = ", ".join(f"{name}={value!r}" for name, value in self.get_options().items())
+        return f"{type(self).__name__}({options})"
+
+
+def _imencode(extension: str, image: np.ndarray, params: List[int]) -> np.ndarray:
+    # OpenCV always allocates the output itself, callers copy it once into their own buffer
+    ok, buf = cv2.imencode(extension, image, params)
+    if not ok:
+        raise RuntimeError(f"OpenCV failed to encode the frame as {extension}")
+
+    return buf.reshape(-1)
+
+
+def _check_quality(quality: Optional[int], maximum: int = 100) -> None:
+    if quality is not None and (not isinstance(quality, int) or not 1 <= quality <= maximum):
+        raise ValueError(f"quality must be None or an integer between 1 and {maximum}")
+
+
+# chroma subsampling as J:a:b, None keeps the OpenCV default (4:2:0)
+_JPEG_SAMPLING_FACTORS = {
+    "444": "IMWRITE_JPEG_SAMPLING_FACTOR_444",
+    "422": "IMWRITE_JPEG_SAMPLING_FACTOR_422",
+    "420": "IMWRITE_JPEG_SAMPLING_FACTOR_420",
+}
+
+
+class JpegEncoder(FrameEncoder):
+
+    format = "jpeg"
+
+    def __init__(self, quality: Optional[int] = None, subsampling: Optional[str] = None):
+        _check_quality(quality)
+
+        if subsampling is not None:
+            if subsampling not in _JPEG_SAMPLING_FACTORS:
+                raise ValueError(f"subsampling must be None or one of {tuple(_JPEG_SAMPLING_FACTORS)}")
+
+            if not hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR"):
+                raise RuntimeError("chroma subsampling needs OpenCV 4.5.5 or newer")
+
+        self.subsampling = subsampling
+        self.set_quality(quality)
+
+    def set_quality(self, quality: Optional[int]) -> None:
+        # takes effect with the next frame, the encoder keeps its buffers and executor
+        _check_quality(quality)
+
+        params = []
+        if quality is not None:
+            params += [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if self.subsampling is not None:
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, getattr(cv2, _JPEG_SAMPLING_FACTORS[self.subsampling])]
+
+        self.quality = quality
+        self._params = params
+
+    def encode(self, image: np.ndarray) -> bytearray:
+        return self._join_output([_imencode(".jpg", image, self._params)])
+
+    def get_options(self) -> Dict:
+        return {"quality": self.quality, "subsampling": self.subsampling}
+
+
+class WebpEncoder(FrameEncoder):
+
+    format = "webp"
+
+    def __init__(self, quality: Optional[int] = None):
+        self.set_quality(quality)
+
+    def set_quality(self, quality: Optional[int]) -> None:
+        # above 100 OpenCV encodes lossless WebP
+        _check_quality(quality, 101)
+
+        self.quality = quality
+        self._params = [cv2.IMWRITE_WEBP_QUALITY, quality] if quality is not None else []
+
+    def encode(self, image: np.ndarray) -> bytearray:
+        return self._join_output([_imencode(".webp", image, self._params)])
+
+    def get_options(self) -> Dict:
+        return {"quality": self.quality}
+
+
+class PngEncoder(FrameEncoder):
+
+    format = "png"
+
+    def __init__(self, compression: int = 1):
+        if not isinstance(compression, int) or not 0 <= compression <= 9:
+            raise ValueError("compression must be an integer between 0 and 9")
+
+        self.compression = compression
+        self._params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+
+    def encode(self, image: np.ndarray) -> bytearray:
+        return self._join_output([_imencode(".png", image, self._params)])
+
+    def get_options(self) -> Dict:
+        return {"compression": self.compression}
+
+
+# MCU size in pixels (width, height) for each chroma subsampling
+_JPEG_MCU_SIZES = {None: (16, 16), "420": (16, 16), "422": (16, 8), "444": (8, 8)}
+
+_SOF0 = 0xC0
+_SOS  = 0xDA
+_DRI  = 0xDD
+_RST0 = 0xD0
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+
+def _get_shared_executor() -> Executor:
+    # OpenCV releases the GIL while encoding, so the strips of every session share one pool
+    global _shared_executor
+
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="webviewer-jpeg")
+
+        return _shared_executor
+
+
+def _split_jpeg(data: np.ndarray) -> Tuple[bytes, int, bytes, memoryview]:
+    # (segments before the scan, offset of the frame height in them, scan header, scan data);
+    # the scan data is a view into the encoder output, only the small headers are copied
+    data = memoryview(data)
+    pos = 2
+    height_offset = None
+    while True:
+        if data[pos] != 0xFF:
+            raise ValueError("malformed JPEG segment")
+
+        marker = data[pos + 1]
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+
+        if marker == _SOF0:
+            height_offset = pos + 5
+        elif marker == _DRI:
+            raise ValueError("JPEG already has restart markers")
+        elif marker == _SOS:
+            break
+
+        pos = end
+
+    if height_offset is None or data[-2:] != b"\xff\xd9":
+        raise ValueError("not a baseline JPEG")
+
+    return bytes(data[:pos]), height_offset, bytes(data[pos:end]), data[end:-2]
+
+
+class ParallelJpegEncoder(JpegEncoder):
+    """
+    Encodes horizontal strips of a frame concurrently and joins them into one
+    baseline JPEG with a restart marker between the strips. A restart marker
+    resets the entropy coder, so each strip can be coded on its own, and the
+    result is an ordinary JPEG any browser decodes. Strips are a whole number
+    of MCU rows high; frames too small for two strips are encoded in one go.
+    """
+
+    def __init__(
+            self,
+            quality:          Optional[int]      = None,
+            subsampling:      Optional[str]      = None,
+            strips:           Optional[int]      = None,
+            min_strip_height: int                = 64,
+            executor:         Optional[Executor] = None,
+        ):
+        super().__init__(quality, subsampling)
+
+        if strips is not None and (not isinstance(strips, int) or strips < 1):
+            raise ValueError("strips must be None or an integer greater than or equal to 1")
+
+        if not isinstance(min_strip_height, int) or min_strip_height < 16:
+            raise ValueError("min_strip_height must be an integer greater than or equal to 16")
+
+        self.strips           = strips
+        self.min_strip_height = min_strip_height
+
+        self._executor = executor
+
+    def get_options(self) -> Dict:
+        return dict(super().get_options(), strips=self.strips, min_strip_height=self.min_strip_height)
+
+    def encode(self, image: np.ndarray) -> bytearray:
+        height, width = image.shape[:2]
+        mcu_width, mcu_height = _JPEG_MCU_SIZES[self.subsampling] if image.ndim == 3 and image.shape[2] > 1 else (8, 8)
+
+        strips = self.strips or os.cpu_count() or 1
+        strips = min(strips, height // max(self.min_strip_height, mcu_height))
+
+        mcu_rows = -(-height // mcu_height)
+        mcu_cols = -(-width // mcu_width)
+        strip_rows = -(-mcu_rows // max(strips, 1))
+
+        # the restart interval is counted in MCUs and stored in 16 bits
+        strip_rows = min(strip_rows, max(1, 0xFFFF // mcu_cols))
+
+        strip_height = strip_rows * mcu_height
+        if strip_height >= height:
+            return super().encode(image)
+
+        executor = self._executor or _get_shared_executor()
+        futures = [
+            executor.submit(_imencode, ".jpg", image[y:y + strip_height], self._params)
+            for y in range(0, height, strip_height)
+        ]
+        parts = [_split_jpeg(future.result()) for future in futures]
+
+        data = self._join(parts, height, strip_rows * mcu_cols)
+        if data is None:
+            return super().encode(image)
+
+        return data
+
+    def _join(self, parts: List[Tuple[bytes, int, bytes, memoryview]], height: int, restart_interval: int) -> Optional[bytearray]:
+        header, height_offset, scan_header, _ = parts[0]
+
+        def tables(part):
+            # everything but the frame height has to match for the scans to be spliced
+            part_header, part_offset = part[0], part[1]
+            return part_header[:part_offset] + part_header[part_offset + 2:], part[2]
+
+        if any(tables(part) != tables(parts[0]) for part in parts[1:]):
+            # e.g. optimized Huffman tables, the strips cannot share one header
+            return None
+
+        chunks = [
+            header[:height_offset],
+            height.to_bytes(2, "big"),
+            header[height_offset + 2:],
+            bytes([0xFF, _DRI, 0x00, 0x04]) + restart_interval.to_bytes(2, "big"),
+            scan_header,
+        ]
+        for index, part in enumerate(parts):
+            if index > 0:
+                chunks.append(bytes([0xFF, _RST0 + (index - 1) % 8]))
+            chunks.append(part[3])
+
+        chunks.append(b"\xff\xd9")
+
+        return self._join_output(chunks)
+
+
+def _as_bgr(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2 or image.shape[2] == 1:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    if image.shape[2] == 4:
+        return image[:, :, :3]
+
+    return image
+
+
+class RawEncoder(FrameEncoder):
+    """
+    Uncompressed 8-bit BGR pixels, row by row. Costs no CPU on either side, so it
+    wins on a fast local link.
+    """
+
+    format = "raw"
+
+    def encode(self, image: np.ndarray) -> bytearray:
+        image = _as_bgr(image)
+        out = self._get_output_buffer(image.size)
+
+        # copies straight into the output, also when the image is not contiguous
+        np.copyto(np.frombuffer(out, np.uint8).reshape(image.shape), image)
+
+        return out
+
+
+class ZlibEncoder(RawEncoder):
+    """
+    Raw BGR pixels compressed with zlib, lossless and cheap on flat-shaded frames.
+    """
+
+    format = "zlib"
+
+    def __init__(self, level: int = 1):
+        if not isinstance(level, int) or not 0 <= level <= 9:
+            raise ValueError("level must be an integer between 0 and 9")
+
+        self.level = level
+
+    def encode(self, image: np.ndarray) -> bytes:
+        return zlib.compress(np.ascontiguousarray(_as_bgr(image)), self.level)
+
+    def get_options(self) -> Dict:
+        return {"level": self.level}
+
+
+ENCODERS: Dict[str, Type[FrameEncoder]] = {}
+
+
+def register_encoder(name: str, encoder_class: Type[FrameEncoder]) -> None:
+    if not isinstance(name, str):
+        raise TypeError("name must be a string")
+
+    if not (isinstance(encoder_class, type) and issubclass(encoder_class, FrameEncoder)):
+        raise TypeError("encoder_class must be a FrameEncoder subclass")
+
+    ENCODERS[name] = encoder_class
+
+
+def create_encoder(encoder: Union[str, FrameEncoder], **options) -> FrameEncoder:
+    if isinstance(encoder, FrameEncoder):
+        if options:
+            raise ValueError("options can only be given with an encoder name")
+
+        return encoder
+
+    if encoder not in ENCODERS:
+        raise ValueError(f"unknown encoder {encoder!r}, expected one of {tuple(ENCODERS)}")
+
+    return ENCODERS[encoder](**options)
+
+
+register_encoder("jpeg", JpegEncoder)
+register_encoder("jpeg_parallel", ParallelJpegEncoder)
+register_encoder("webp", WebpEncoder)
+register_encoder("png",  PngEncoder)
+register_encoder("raw",  RawEncoder)
+register_encoder("zlib", ZlibEncoder)
+
+
+# tried by calibrate_encoders when no candidates are given
+DEFAULT_CANDIDATES: Tuple[Tuple[str, Dict], ...] = (
+    ("jpeg", {"quality": 95}),
+    ("jpeg", {"quality": 80}),
+    ("jpeg", {"quality": 60}),
+    ("webp", {"quality": 80}),
+    ("png",  {"compression": 1}),
+    ("zlib", {"level": 1}),
+    ("raw",  {}),
+)
+
+
+def calibrate_encoders(
+        frames:     Sequence[np.ndarray],
+        candidates: Optional[Sequence[Union[FrameEncoder, Tuple[str, Dict]]]] = None,
+        repeat:     int = 1,
+    ) -> List[Dict]:
+    """
+    Encodes the frames with every candidate and returns one result per candidate
+    with the mean encode time in seconds and the mean size in bytes.
+    """
+    if not frames:
+        raise ValueError("calibration needs at least one frame")
+
+    if candidates is None:
+        candidates = DEFAULT_CANDIDATES
+
+    results = []
+    for candidate in candidates:
+        if isinstance(candidate, FrameEncoder):
+            encoder = candidate
+        else:
+            name, options = candidate
+            encoder = create_encoder(name, **options)
+
+        # the first call pays for lazy initialization inside the codec
+        encoder.encode(frames[0])
+
+        sizes = []
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            for frame in frames:
+                sizes.append(len(encoder.encode(frame)))
+        elapsed = time.perf_counter() - start_time
+
+        results.append({
+            "encoder":     encoder,
+            "format":      encoder.format,
+            "options":     encoder.get_options(),
+            "encode_time": elapsed / len(sizes),
+            "bytes":       float(np.mean(sizes)),
+        })
+
+    return results
+
+
+def choose_encoder(results: Sequence[Dict], max_bytes: Optional[int] = None) -> FrameEncoder:
+    """
+    The fastest calibrated encoder whose frames fit into max_bytes on average,
+    or the one with the smallest frames if none fits.
+    """
+    if not results:
+        raise ValueError("results must not be empty")
+
+    fitting = [result for result in results if max_bytes is None or result["bytes"] <= max_bytes]
+    if fitting:
+        return min(fitting, key=lambda result: result["encode_time"])["encoder"]
+
+    return min(results, key=lambda result: result["bytes"])["encoder"]
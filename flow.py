@@ -0,0 +1,55 @@
+import collections
+import time
+from typing import Optional
+
+
+class FlowWindow:
+    """
+    Tracks the frames sent to one client that it has not acknowledged yet.
+    Not thread-safe, callers hold their own lock.
+    """
+
+    def __init__(
+            self,
+            max_frames_in_flight: Optional[int] = 2,
+            ack_timeout:          float         = 2.0,
+        ):
+        self.max_frames_in_flight = max_frames_in_flight
+        self.ack_timeout          = ack_timeout
+
+        # smoothed time the client needs to decode and draw a frame
+        self.frame_time = 0.0
+
+        self._in_flight = collections.OrderedDict()
+
+    def is_full(self) -> bool:
+        if self.max_frames_in_flight is None:
+            return False
+
+        self._expire()
+        return len(self._in_flight) >= self.max_frames_in_flight
+
+    def get_in_flight_num(self) -> int:
+        return len(self._in_flight)
+
+    def sent(self, seq: int) -> None:
+        if self.max_frames_in_flight is not None:
+            self._in_flight[seq] = time.time()
+
+    def ack(self, seq: int, decode_time: Optional[float] = None) -> None:
+        # acks are cumulative
+        while self._in_flight and next(iter(self._in_flight)) <= seq:
+            self._in_flight.popitem(last=False)
+
+        if decode_time is not None and decode_time >= 0:
+            self.frame_time = 0.8 * self.frame_time + 0.2 * decode_time
+
+    def _expire(self) -> None:
+        # frames whose ack got lost must not block the window forever
+        now = time.time()
+        while self._in_flight:
+            seq, send_time = next(iter(self._in_flight.items()))
+            if now - send_time < self.ack_timeout:
+                break
+
+            self._in_flight.popitem(last=False)
@@ -0,0 +1,143 @@
+import collections
+import json
+import struct
+import threading
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+
+# record types of the binary input channel, every record starts with its type byte
+INPUT_MOVE    = 1  # int32 x, y, last_x, last_y
+INPUT_BUTTON  = 2  # uint8 button (0 left, 2 right), uint8 pressed
+INPUT_WHEEL   = 3  # float32 delta
+INPUT_CONTROL = 4  # uint8 id length, uint32 json length, id, json payload
+INPUT_STAMP   = 5  # uint32 input id, float64 client time in ms, starts a batch
+
+_MOVE    = struct.Struct("<4i")
+_BUTTON  = struct.Struct("<BB")
+_WHEEL   = struct.Struct("<f")
+_CONTROL = struct.Struct("<BI")
+_STAMP   = struct.Struct("<Id")
+
+
+class MouseMove(NamedTuple):
+    x:       int
+    y:       int
+    last_x:  int
+    last_y:  int
+    samples: List[Tuple[int, int]]
+
+
+class MouseMoveCoalescer:
+    """
+    Merges the mouse moves received between two frames into one move from the
+    position before the first of them to the latest one, so the accumulated
+    delta is kept. The individual positions are kept too if asked for.
+    """
+
+    def __init__(self, keep_samples: bool = False, max_samples: int = 256):
+        if not isinstance(max_samples, int) or max_samples < 1:
+            raise ValueError("max_samples must be an integer greater than or equal to 1")
+
+        self.keep_samples = keep_samples
+
+        self._lock    = threading.Lock()
+        self._pending: Optional[Tuple[int, int, int, int]] = None
+        self._samples = collections.deque(maxlen=max_samples)
+
+        self.merged_moves = 0
+
+    def push(self, x: int, y: int, last_x: int, last_y: int) -> None:
+        with self._lock:
+            if self._pending is None:
+                self._pending = (x, y, last_x, last_y)
+            else:
+                self._pending = (x, y, self._pending[2], self._pending[3])
+                self.merged_moves += 1
+
+            if self.keep_samples:
+                self._samples.append((x, y))
+
+    def take(self) -> Optional[MouseMove]:
+        with self._lock:
+            if self._pending is None:
+                return None
+
+            pending, self._pending = self._pending, None
+            samples = list(self._samples)
+            self._samples.clear()
+
+        return MouseMove(*pending, samples)
+
+
+class InputStamp(NamedTuple):
+    input_id:     int
+    client_time:  float  # ms on the client clock, echoed back untouched
+    receive_time: float  # server time.time()
+    sid:          Optional[str]
+
+
+def pack_stamp(input_id: int, client_time: float) -> bytes:
+    return bytes([INPUT_STAMP]) + _STAMP.pack(input_id, client_time)
+
+
+def pack_mouse_move(x: int, y: int, last_x: int, last_y: int) -> bytes:
+    return bytes([INPUT_MOVE]) + _MOVE.pack(x, y, last_x, last_y)
+
+
+def pack_mouse_button(button: int, pressed: bool) -> bytes:
+    return bytes([INPUT_BUTTON]) + _BUTTON.pack(button, int(pressed))
+
+
+def pack_mouse_wheel(delta: float) -> bytes:
+    return bytes([INPUT_WHEEL]) + _WHEEL.pack(delta)
+
+
+def pack_control(control_id: str, data: dict) -> bytes:
+    control_id = control_id.encode("ascii")
+    data = json.dumps(data).encode("utf-8")
+
+    return bytes([INPUT_CONTROL]) + _CONTROL.pack(len(control_id), len(data)) + control_id + data
+
+
+def decode_input_batch(payload: Union[bytes, bytearray, memoryview]) -> Iterator[Tuple]:
+    # yields (INPUT_MOVE, x, y, last_x, last_y), (INPUT_BUTTON, button, pressed),
+    # (INPUT_WHEEL, delta), (INPUT_CONTROL, control_id, data) and
+    # (INPUT_STAMP, input_id, client_time) in order
+    view = memoryview(payload)
+    offset = 0
+
+    try:
+        while offset < len(view):
+            kind = view[offset]
+            offset += 1
+
+            if kind == INPUT_MOVE:
+                yield (kind, *_MOVE.unpack_from(view, offset))
+                offset += _MOVE.size
+            elif kind == INPUT_BUTTON:
+                button, pressed = _BUTTON.unpack_from(view, offset)
+                yield kind, button, bool(pressed)
+                offset += _BUTTON.size
+            elif kind == INPUT_WHEEL:
+                yield (kind, *_WHEEL.unpack_from(view, offset))
+                offset += _WHEEL.size
+            elif kind == INPUT_STAMP:
+                yield (kind, *_STAMP.unpack_from(view, offset))
+                offset += _STAMP.size
+            elif kind == INPUT_CONTROL:
+                id_length, data_length = _CONTROL.unpack_from(view, offset)
+                offset += _CONTROL.size
+
+                end = offset + id_length + data_length
+                if end > len(view):
+                    raise ValueError("truncated control record")
+
+                control_id = bytes(view[offset:offset + id_length]).decode("ascii")
+                data = json.loads(bytes(view[offset + id_length:end]))
+                offset = end
+
+                yield kind, control_id, data
+            else:
+                raise ValueError(f"unknown input record type {kind}")
+    except struct.error as e:
+        raise ValueError(f"truncated input record: {e}") from None
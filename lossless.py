@@ -0,0 +1,75 @@
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+from .encoders import _as_bgr
+from .tiles import DeltaEncoder
+
+
+RESIDUAL_MODES = ("xor", "sub")
+
+
+class LosslessDeltaEncoder(DeltaEncoder):
+    """
+    Lossless frames for label maps and heatmaps: a zlib keyframe, then only the
+    residual against the last frame that was sent, XOR or difference modulo 256,
+    zlib compressed and cropped to the rows that changed. Unchanged pixels turn
+    into runs of zeros, so frames that barely change cost next to nothing, and
+    identical frames are not sent at all.
+
+    Keyframes are sent on the first frame, on request, after a size change and
+    every `keyframe_interval` frames.
+    """
+
+    format = "zlib"
+
+    def __init__(self, keyframe_interval: int = 120, mode: str = "xor", level: int = 1):
+        if mode not in RESIDUAL_MODES:
+            raise ValueError(f"mode must be one of {RESIDUAL_MODES}")
+
+        if not isinstance(level, int) or not 0 <= level <= 9:
+            raise ValueError("level must be an integer between 0 and 9")
+
+        super().__init__(keyframe_interval)
+
+        self.mode  = mode
+        self.level = level
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(_as_bgr(image))
+
+    def _encode_key(self, image: np.ndarray, encode_image=None) -> Dict:
+        # encode_image is ignored, frames are always zlib
+        return {
+            'type':   'key',
+            'format': self.format,
+            'image':  zlib.compress(image, self.level),
+            'width':  image.shape[1],
+            'height': image.shape[0],
+        }
+
+    def _encode_delta(self, reference: np.ndarray, image: np.ndarray, encode_image=None) -> Optional[Dict]:
+        height, width = image.shape[:2]
+
+        if self.mode == "xor":
+            residual = np.bitwise_xor(image, reference)
+        else:
+            # uint8 arithmetic wraps around, the client adds modulo 256
+            residual = np.subtract(image, reference)
+
+        rows = np.flatnonzero(residual.reshape(height, -1).any(axis=1))
+        if len(rows) == 0:
+            return None
+
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+
+        return {
+            'type':   'residual',
+            'format': self.format,
+            'mode':   self.mode,
+            'image':  zlib.compress(residual[top:bottom], self.level),
+            'y':      top,
+            'width':  width,
+            'height': bottom - top,
+        }
@@ -0,0 +1,127 @@
+import collections
+import threading
+import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class FramePipeline:
+    """
+    Decouples the render stage of a session from encoding and sending.
+
+    Rendered frames wait in a bounded queue until an encoder thread picks them
+    up; encoded frames are emitted in render order, and a frame that finishes
+    encoding after a newer one has already been sent is discarded.
+    """
+
+    def __init__(
+            self,
+            executor:       Optional[Executor] = None,
+            *,
+            encode_workers: int                = 2,
+            queue_depth:    int                = 2,
+            drop_policy:    str                = "drop_oldest",
+        ):
+        if not isinstance(queue_depth, int) or queue_depth < 1:
+            raise ValueError("queue_depth must be an integer greater than or equal to 1")
+
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}")
+
+        if executor is None:
+            if not isinstance(encode_workers, int) or encode_workers < 1:
+                raise ValueError("encode_workers must be an integer greater than or equal to 1")
+
+            executor = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix="webviewer-encode")
+            self._owns_executor = True
+        else:
+            self._owns_executor = False
+
+        self._executor   = executor
+        self.queue_depth = queue_depth
+        self.drop_policy = drop_policy
+
+        self._cond      = threading.Condition()
+        self._emit_lock = threading.Lock()
+        self._pending   = collections.deque()
+        self._next_seq  = 0
+        self._last_emitted_seq = -1
+        self._closed    = False
+
+        self.dropped_frames = 0
+
+    def submit(
+            self,
+            encode_func: Callable[[], Any],
+            emit_func:   Callable[[Any], None],
+        ) -> bool:
+        with self._cond:
+            if self._closed:
+                return False
+
+            if len(self._pending) >= self.queue_depth:
+                if self.drop_policy == "drop_newest":
+                    self.dropped_frames += 1
+                    return False
+                elif self.drop_policy == "drop_oldest":
+                    self._pending.popleft()
+                    self.dropped_frames += 1
+                else:
+                    self._cond.wait_for(lambda: self._closed or len(self._pending) < self.queue_depth)
+                    if self._closed:
+                        return False
+
+            self._pending.append((self._next_seq, encode_func, emit_func))
+            self._next_seq += 1
+
+        self._executor.submit(self._run_one)
+        return True
+
+    def get_pending_num(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    def _run_one(self) -> None:
+        with self._cond:
+            if not self._pending:
+                # the job was dropped in favour of a newer frame
+                return
+
+            seq, encode_func, emit_func = self._pending.popleft()
+            self._cond.notify_all()
+
+        try:
+            data = encode_func()
+        except Exception:
+            traceback.print_exc()
+            return
+
+        if data is None:
+            return
+
+        with self._emit_lock:
+            if self._closed:
+                return
+
+            if seq <= self._last_emitted_seq:
+                self.dropped_frames += 1
+                return
+
+            self._last_emitted_seq = seq
+
+            try:
+                emit_func(data)
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,349 @@
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+import weakref
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .buffers import FrameBufferPool, as_image
+
+
+# Session attributes every render process gets with each frame
+SNAPSHOT_FIELDS = (
+    "image_width",
+    "image_height",
+    "canvas_width",
+    "canvas_height",
+    "x",
+    "y",
+    "last_x",
+    "last_y",
+    "left_mouse_pressing",
+    "right_mouse_pressing",
+    "padding_x",
+    "padding_y",
+    "mouse_samples",
+)
+
+_PLAIN_TYPES = (bool, int, float, str, type(None))
+
+# segments a render process keeps attached, enough for the buffer pools of a few sessions
+_MAX_SEGMENTS = 16
+
+
+def default_render_processes() -> int:
+    return os.cpu_count() or 1
+
+
+def _get_control_state(control) -> Dict[str, Any]:
+    # public plain attributes, e.g. value/min/max of a slider or checked of a checkbox
+    return {
+        name: value
+        for name, value in vars(control).items()
+        if not name.startswith("_") and isinstance(value, _PLAIN_TYPES)
+    }
+
+
+def _collect_controls(name: str, control, controls: Dict[str, Dict]) -> None:
+    controls[name] = _get_control_state(control)
+
+    for nested_name, nested_control in control._get_nested_controls().items():
+        _collect_controls(f"{name}.{nested_name}", nested_control, controls)
+
+
+class SessionSnapshot:
+    """
+    The picklable part of a Session that a render process gets with every frame.
+    Controls are looked up like on a Session and expose their state as
+    attributes, e.g. snapshot["speed"].value.
+    """
+
+    def __init__(self, sid: Optional[str], fields: Dict[str, Any], controls: Dict[str, Dict]):
+        self.sid = sid
+        self.__dict__.update(fields)
+
+        self._controls = controls
+
+    @classmethod
+    def capture(cls, session, state_fields: Sequence[str] = ()) -> "SessionSnapshot":
+        fields = {name: getattr(session, name, None) for name in (*SNAPSHOT_FIELDS, *state_fields)}
+
+        controls = {}
+        for name in session._controls_names:
+            _collect_controls(name, session.get_control(name), controls)
+
+        return cls(session._sid, fields, controls)
+
+    def get_control(self, name: str) -> SimpleNamespace:
+        if not isinstance(name, str):
+            raise TypeError("name must be a string")
+
+        return SimpleNamespace(**self._controls[name])
+
+    def __getitem__(self, name: str) -> SimpleNamespace:
+        return self.get_control(name)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the front end owns the segments, a render process must not unlink them when it exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    # before Python 3.13 attaching registers the segment with the resource tracker
+    # shared with the front end, which would then see it unlinked twice
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def _release_segment(segment: shared_memory.SharedMemory) -> None:
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedFrameBufferPool(FrameBufferPool):
+    """
+    A FrameBufferPool whose buffers live in shared memory, so a render process
+    can write a frame that the front end encodes without copying it. A segment
+    is unlinked once its buffer is dropped by the pool and no longer referenced.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._segment_names: Dict[int, str] = {}
+
+    def get_segment_name(self, buffer: np.ndarray) -> str:
+        return self._segment_names[id(buffer)]
+
+    def _allocate(self, shape: Tuple[int, int, int]) -> np.ndarray:
+        size = max(1, int(np.prod(shape)) * self.dtype.itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=size)
+
+        buffer = np.ndarray(shape, self.dtype, buffer=segment.buf)
+        self._segment_names[id(buffer)] = segment.name
+
+        weakref.finalize(buffer, self._segment_names.pop, id(buffer), None)
+        weakref.finalize(buffer, _release_segment, segment)
+
+        return buffer
+
+
+def _worker_main(renderer_factory: Callable[[], Any], conn) -> None:
+    from .base_viewer import UNCHANGED
+
+    renderer = renderer_factory()
+    render_into = getattr(renderer, "render_into", None)
+    render = getattr(renderer, "render", renderer)
+
+    # least recently used first
+    segments: "collections.OrderedDict[str, shared_memory.SharedMemory]" = collections.OrderedDict()
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+
+        if job is None:
+            break
+
+        snapshot, segment_name, shape, dtype = job
+
+        try:
+            segment = segments.get(segment_name)
+            if segment is None:
+                # sessions share the processes and each has several buffers, segments the
+                # front end replaced or unlinked are closed once they are the least recently used
+                while len(segments) >= _MAX_SEGMENTS:
+                    segments.popitem(last=False)[1].close()
+
+                segment = segments[segment_name] = _attach(segment_name)
+            else:
+                segments.move_to_end(segment_name)
+
+            out = np.ndarray(shape, dtype, buffer=segment.buf)
+            height, width = shape[:2]
+
+            if render_into is not None:
+                image = render_into(out, snapshot)
+            else:
+                image = render(width=width, height=height, session=snapshot)
+
+            if image is None:
+                conn.send(("none",))
+            elif image is UNCHANGED:
+                conn.send(("unchanged",))
+            else:
+                if image is not out:
+                    out[...] = as_image(image, width, height, dtype)
+
+                conn.send(("frame",))
+        except NotImplementedError:
+            conn.send(("not_implemented",))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+        # views must be gone before a stale segment can be closed
+        out = image = None
+
+    for segment in segments.values():
+        segment.close()
+
+
+class _Worker:
+
+    def __init__(self, context, renderer_factory: Callable[[], Any]):
+        self.conn, child_conn = context.Pipe()
+
+        self.process = context.Process(
+            target = _worker_main,
+            args   = (renderer_factory, child_conn),
+            daemon = True,
+        )
+        self.process.start()
+        child_conn.close()
+
+
+class ProcessRenderPool:
+    """
+    Renders in worker processes instead of threads, so CPU-bound Python renderers
+    are not serialized on the GIL. Each process builds its own renderer with
+    renderer_factory(), which must be picklable, and gets a SessionSnapshot per
+    frame. The frame is written into a shared memory buffer of the session. The
+    render threads of the front end only wait for the processes.
+    """
+
+    def __init__(
+            self,
+            renderer_factory: Callable[[], Any],
+            num_processes:    Optional[int]  = None,
+            state_fields:     Sequence[str]  = (),
+            channels:         int            = 3,
+            dtype                            = np.uint8,
+            start_method:     str            = "spawn",
+        ):
+        if num_processes is None:
+            num_processes = default_render_processes()
+
+        if not isinstance(num_processes, int) or num_processes < 1:
+            raise ValueError("num_processes must be an integer greater than or equal to 1")
+
+        self.renderer_factory = renderer_factory
+        self.num_processes    = num_processes
+        self.state_fields     = tuple(state_fields)
+        self.channels         = channels
+        self.dtype            = np.dtype(dtype)
+
+        self._context = multiprocessing.get_context(start_method)
+        self._lock    = threading.Lock()
+        self._idle    = queue.Queue()
+        self._workers = []
+        self._buffers = weakref.WeakKeyDictionary()
+        self._closed  = False
+
+    def start(self) -> None:
+        with self._lock:
+            for _ in range(self.num_processes - len(self._workers)):
+                self._add_worker()
+
+    def get_process_num(self) -> int:
+        with self._lock:
+            return len(self._workers)
+
+    def render(self, width: int, height: int, session, **kwargs):
+        from .base_viewer import UNCHANGED
+
+        snapshot = SessionSnapshot.capture(session, self.state_fields)
+
+        buffers = self._get_buffers(session)
+        out = buffers.acquire(width, height)
+
+        worker = self._idle.get()
+        if worker is None:
+            self._idle.put(None)
+            raise RuntimeError("the process render pool is shut down")
+
+        try:
+            worker.conn.send((snapshot, buffers.get_segment_name(out), out.shape, out.dtype.str))
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            self._replace_worker(worker)
+            worker = None
+            raise RuntimeError("a render process exited unexpectedly")
+        finally:
+            # any other error, e.g. a snapshot that does not pickle, leaves the process usable
+            if worker is not None:
+                self._idle.put(worker)
+
+        if result[0] == "frame":
+            return out
+        elif result[0] == "none":
+            return None
+        elif result[0] == "unchanged":
+            return UNCHANGED
+        elif result[0] == "not_implemented":
+            raise NotImplementedError("the renderer does not implement render")
+        else:
+            raise RuntimeError(f"render process failed:\n{result[1]}")
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+
+        # wakes up render threads still waiting for a process
+        self._idle.put(None)
+
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+            worker.conn.close()
+
+    def _get_buffers(self, session) -> SharedFrameBufferPool:
+        with self._lock:
+            buffers = self._buffers.get(session)
+            if buffers is None:
+                buffers = self._buffers[session] = SharedFrameBufferPool(self.channels, self.dtype)
+
+            return buffers
+
+    def _add_worker(self) -> None:
+        # must be called with _lock held
+        worker = _Worker(self._context, self.renderer_factory)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace_worker(self, worker: _Worker) -> None:
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+
+            worker.conn.close()
+
+            if not self._closed:
+                self._add_worker()
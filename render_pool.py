@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from typing import Optional
+
+
+def default_render_workers() -> int:
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class RenderWorkerPool:
+    """
+    A fixed number of render threads shared by all sessions. Sessions are queued
+    by the time their next frame is due; idle sessions (waiting for the canvas or
+    for a redraw in on-demand mode) hold no thread until request_redraw() wakes them.
+    """
+
+    def __init__(
+            self,
+            socketio,
+            render_func,
+            num_workers: Optional[int] = None,
+        ):
+        if num_workers is None:
+            num_workers = default_render_workers()
+
+        if not isinstance(num_workers, int) or num_workers < 1:
+            raise ValueError("num_workers must be an integer greater than or equal to 1")
+
+        self._socketio    = socketio
+        self._render_func = render_func
+
+        self._cond     = threading.Condition()
+        self._heap     = []
+        self._counter  = itertools.count()
+        self._idle     = set()
+        self._sessions = set()
+        self._reaped   = 0
+        self._shutdown = False
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"webviewer-render-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def add(self, session) -> None:
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("RenderWorkerPool has been shut down")
+
+            session._scheduler = self
+            self._sessions.add(session)
+            self._push(session, 0)
+
+    def wake(self, session) -> None:
+        with self._cond:
+            if session in self._idle:
+                self._idle.discard(session)
+                self._push(session, 0)
+
+    def get_live_session_num(self) -> int:
+        with self._cond:
+            return len(self._sessions)
+
+    def get_reaped_session_num(self) -> int:
+        with self._cond:
+            return self._reaped
+
+    def get_worker_num(self) -> int:
+        return len(self._workers)
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            self._shutdown = True
+            sessions = list(self._sessions)
+            self._cond.notify_all()
+
+        for session in sessions:
+            session.stop()
+
+        for worker in self._workers:
+            worker.join(timeout)
+
+        with self._cond:
+            for session in list(self._sessions):
+                self._reap(session)
+
+    def _push(self, session, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), session))
+        self._cond.notify()
+
+    def _reap(self, session) -> None:
+        if session not in self._sessions:
+            return
+
+        self._sessions.discard(session)
+        self._idle.discard(session)
+        self._reaped += 1
+        session._scheduler = None
+        session._finish()
+
+    def _next_session(self):
+        with self._cond:
+            while not self._shutdown:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                due_time, _, session = self._heap[0]
+                wait_time = due_time - time.monotonic()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+
+                heapq.heappop(self._heap)
+
+                if session.is_stopped():
+                    self._reap(session)
+                elif session._take_redraw_request():
+                    return session
+                else:
+                    self._idle.add(session)
+
+            return None
+
+    def _work(self) -> None:
+        while True:
+            session = self._next_session()
+            if session is None:
+                return
+
+            try:
+                delay = session.render_frame(self._socketio, self._render_func)
+            except Exception:
+                traceback.print_exc()
+                delay = None
+
+            with self._cond:
+                if delay is None or session.is_stopped() or self._shutdown:
+                    self._reap(session)
+                else:
+                    self._push(session, delay)
@@ -0,0 +1,132 @@
+import math
+import threading
+from typing import Dict, Optional, Tuple
+
+
+STAGES = ("render", "encode", "emit")
+
+
+class ResolutionController:
+    """
+    Picks the frame size for dynamic resolution from per-stage timings.
+
+    Every stage is modelled as costing a fixed time per pixel, tracked as an
+    exponential moving average. The pixel budget is the frame interval divided
+    by the cost of the stages on the critical path (all of them in sequence, or
+    the slowest one when encoding is pipelined). The size then moves toward the
+    budget geometrically, ignoring errors within the deadband so that it does
+    not hunt around the target.
+
+    The controller holds no reference to a session, so it can be driven by
+    recorded timing traces.
+    """
+
+    def __init__(
+            self,
+            smoothing: float = 0.2,
+            deadband:  float = 0.1,
+        ):
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in (0, 1]")
+
+        if deadband < 0:
+            raise ValueError("deadband must be non-negative")
+
+        self.smoothing = smoothing
+        self.deadband  = deadband
+
+        self._lock = threading.Lock()
+        self._cost: Dict[str, float] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._cost = {}
+
+    def record(self, stage: str, seconds: float, pixels: int) -> None:
+        if stage not in STAGES:
+            raise ValueError(f"stage must be one of {STAGES}")
+
+        if seconds <= 0 or pixels <= 0:
+            return
+
+        cost = seconds / pixels
+
+        with self._lock:
+            if stage in self._cost:
+                self._cost[stage] += self.smoothing * (cost - self._cost[stage])
+            else:
+                self._cost[stage] = cost
+
+    def get_stage_costs(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._cost)
+
+    def predict_frame_time(self, pixels: int, pipelined: bool = False) -> Optional[float]:
+        with self._lock:
+            if "render" not in self._cost:
+                return None
+
+            costs = list(self._cost.values())
+
+        if pipelined:
+            return max(costs) * pixels
+
+        return sum(costs) * pixels
+
+    def update(
+            self,
+            width:             int,
+            height:            int,
+            *,
+            aspect_ratio:      float,
+            target_frame_rate: float,
+            min_pixel:         int,
+            max_pixel:         int,
+            gain:              float = 0.3,
+            canvas_size:       Optional[Tuple[int, int]] = None,
+            pipelined:         bool  = False,
+        ) -> Tuple[int, int]:
+        # aspect_ratio is height / width, like Session.render_aspect_ratio
+        pixels = width * height
+        frame_time = self.predict_frame_time(pixels, pipelined)
+
+        if frame_time is None:
+            error = 0.0
+        else:
+            error = math.log((1.0 / target_frame_rate) / frame_time)
+
+        if abs(error) > self.deadband:
+            return self._fit(pixels * math.exp(min(1.0, gain) * error), aspect_ratio, min_pixel, max_pixel, canvas_size)
+
+        # fitting truncates to whole pixels, so the current size is kept unless the
+        # aspect ratio or the limits moved it by more than that
+        fitted_width, fitted_height = self._fit(pixels, aspect_ratio, min_pixel, max_pixel, canvas_size)
+        if abs(fitted_width - width) <= 1 and abs(fitted_height - height) <= 1:
+            return width, height
+
+        return fitted_width, fitted_height
+
+    def _fit(
+            self,
+            pixels:       float,
+            aspect_ratio: float,
+            min_pixel:    int,
+            max_pixel:    int,
+            canvas_size:  Optional[Tuple[int, int]],
+        ) -> Tuple[int, int]:
+        width  = math.sqrt(pixels / aspect_ratio)
+        height = width * aspect_ratio
+
+        # the longer side is kept within [min_pixel, max_pixel] and not beyond the canvas
+        if aspect_ratio < 1.0:
+            longest, canvas_longest = width, (canvas_size[0] if canvas_size else None)
+        else:
+            longest, canvas_longest = height, (canvas_size[1] if canvas_size else None)
+
+        upper = max_pixel
+        if canvas_longest:
+            upper = max(min_pixel, min(upper, int(canvas_longest)))
+
+        scale = min(max(longest, min_pixel), upper) / longest
+
+        return max(1, int(width * scale)), max(1, int(height * scale))
@@ -0,0 +1,300 @@
+import struct
+import sys
+import threading
+import weakref
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .buffers import _FREE_REFCOUNT
+from .process_render import _attach
+
+
+# header: magic, version, slot count, channels, slot capacity in bytes,
+# requested width/height (written by the viewer), latest complete slot (written
+# by the producer), mask of the slots the viewer still reads and closed flag
+# (written by the viewer). After creation each side writes only its own fields,
+# one at a time, so neither overwrites what the other wrote meanwhile.
+_HEADER_FIELDS = ("4s", "I", "I", "I", "Q", "I", "I", "i", "Q", "I")
+_HEADER = struct.Struct("<" + "".join(_HEADER_FIELDS))
+# offset and layout of every header field
+_FIELDS = [
+    (struct.calcsize("<" + "".join(_HEADER_FIELDS[:index])), struct.Struct("<" + field))
+    for index, field in enumerate(_HEADER_FIELDS)
+]
+_REQUESTED_SIZE = struct.Struct("<II")
+# per slot: sequence number (odd while being written), width, height
+_SLOT   = struct.Struct("<QII")
+
+_MAGIC   = b"WVFS"
+_VERSION = 1
+_ALIGN   = 64
+
+_MAX_SLOTS = 64
+
+
+def _data_offset(num_slots: int) -> int:
+    offset = _HEADER.size + num_slots * _SLOT.size
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class _NoSession:
+    # stands in for the session when render() is called without one
+    pass
+
+
+_NO_SESSION = _NoSession()
+
+
+def _get_key(session):
+    return _NO_SESSION if session is None else session
+
+
+class _FrameRing:
+
+    def __init__(self, segment: shared_memory.SharedMemory):
+        self.segment = segment
+
+        magic, version, self.num_slots, self.channels, self.slot_capacity, *_ = _HEADER.unpack_from(segment.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{segment.name} is not a frame ring")
+
+        self.data_offset = _data_offset(self.num_slots)
+
+    def _get(self, index: int):
+        offset, field = _FIELDS[index]
+        return field.unpack_from(self.segment.buf, offset)[0]
+
+    def _set(self, index: int, value) -> None:
+        offset, field = _FIELDS[index]
+        field.pack_into(self.segment.buf, offset, value)
+
+    def get_requested_size(self) -> Tuple[int, int]:
+        return _REQUESTED_SIZE.unpack_from(self.segment.buf, _FIELDS[5][0])
+
+    def set_requested_size(self, width: int, height: int) -> None:
+        _REQUESTED_SIZE.pack_into(self.segment.buf, _FIELDS[5][0], width, height)
+
+    def get_latest_slot(self) -> int:
+        return self._get(7)
+
+    def get_claimed_mask(self) -> int:
+        return self._get(8)
+
+    def is_closed(self) -> bool:
+        return bool(self._get(9))
+
+    def get_slot(self, slot: int) -> Tuple[int, int, int]:
+        return _SLOT.unpack_from(self.segment.buf, _HEADER.size + slot * _SLOT.size)
+
+    def set_slot(self, slot: int, seq: int, width: int, height: int) -> None:
+        _SLOT.pack_into(self.segment.buf, _HEADER.size + slot * _SLOT.size, seq, width, height)
+
+    def get_view(self, slot: int, width: int, height: int) -> np.ndarray:
+        offset = self.data_offset + slot * self.slot_capacity
+        return np.ndarray((height, width, self.channels), np.uint8, buffer=self.segment.buf, offset=offset)
+
+
+class SharedMemoryFrameSource:
+    """
+    Frames written by an external renderer process into a ring of shared memory
+    slots. Use it as the frame source of a viewer or session: the latest complete
+    slot is encoded straight from shared memory, and the size picked by dynamic
+    resolution is passed to the producer as the requested size.
+
+    Several sessions can render from one source: each gets every new frame
+    once, and the producer is asked for the largest size any of them wants.
+
+    A slot is complete when its sequence number is even. The producer never
+    writes into the latest slot or into a slot the viewer still holds a view of,
+    so a frame being encoded is not overwritten. One source serves one stream of
+    frames, so all sessions see the same picture. Frames still queued for
+    encoding keep their slots, so use more slots than the encode pipelines of
+    all sessions together are deep.
+    """
+
+    def __init__(
+            self,
+            max_width:  int,
+            max_height: int,
+            channels:   int           = 3,
+            num_slots:  int           = 4,
+            name:       Optional[str] = None,
+        ):
+        if not isinstance(num_slots, int) or not 3 <= num_slots <= _MAX_SLOTS:
+            raise ValueError(f"num_slots must be an integer between 3 and {_MAX_SLOTS}")
+
+        if not isinstance(channels, int) or channels < 1:
+            raise ValueError("channels must be an integer greater than or equal to 1")
+
+        slot_capacity = (max_width * max_height * channels + _ALIGN - 1) // _ALIGN * _ALIGN
+        size = _data_offset(num_slots) + num_slots * slot_capacity
+
+        segment = shared_memory.SharedMemory(name, create=True, size=size)
+        _HEADER.pack_into(segment.buf, 0, _MAGIC, _VERSION, num_slots, channels, slot_capacity, max_width, max_height, -1, 0, 0)
+        for slot in range(num_slots):
+            _SLOT.pack_into(segment.buf, _HEADER.size + slot * _SLOT.size, 0, 0, 0)
+
+        self.max_width  = max_width
+        self.max_height = max_height
+
+        self._ring  = _FrameRing(segment)
+        self._lock  = threading.Lock()
+        self._views: List[List[np.ndarray]] = [[] for _ in range(num_slots)]
+        # per session: sequence number of the last frame it got and the size it wants
+        self._last_seqs       = weakref.WeakKeyDictionary()
+        self._requested_sizes = weakref.WeakKeyDictionary()
+
+    @property
+    def name(self) -> str:
+        return self._ring.segment.name
+
+    def request_size(self, width: int, height: int, session=None) -> None:
+        with self._lock:
+            self._requested_sizes[_get_key(session)] = (width, height)
+
+            width  = min(self.max_width, max(size[0] for size in self._requested_sizes.values()))
+            height = min(self.max_height, max(size[1] for size in self._requested_sizes.values()))
+
+            if self._ring.get_requested_size() != (width, height):
+                self._ring.set_requested_size(width, height)
+
+    def render(self, width: int, height: int, session=None, **kwargs):
+        # a render function: the latest complete frame, UNCHANGED if it was already
+        # returned, or None while the producer has not written any frame yet
+        from .base_viewer import UNCHANGED
+
+        self.request_size(width, height, session)
+        key = _get_key(session)
+
+        with self._lock:
+            self._update_claims()
+
+            for _ in range(self._ring.num_slots):
+                slot = self._ring.get_latest_slot()
+                if slot < 0:
+                    return None
+
+                seq, frame_width, frame_height = self._ring.get_slot(slot)
+                if seq % 2 == 1 or seq == 0:
+                    return None
+
+                if seq == self._last_seqs.get(key):
+                    return UNCHANGED
+
+                view = self._ring.get_view(slot, frame_width, frame_height)
+                self._views[slot].append(view)
+                self._update_claims()
+
+                # the producer may have moved on and started on this slot before it was claimed
+                if self._ring.get_slot(slot)[0] == seq:
+                    self._last_seqs[key] = seq
+                    return view
+
+                self._views[slot].pop()
+                del view
+                self._update_claims()
+
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._ring._set(9, 1)
+            self._views = [[] for _ in self._views]
+
+        self._ring.segment.close()
+        try:
+            self._ring.segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _update_claims(self) -> None:
+        # must be called with _lock held; the latest slot is always protected by the producer
+        mask = 0
+        for slot, views in enumerate(self._views):
+            views[:] = [view for view in views if sys.getrefcount(view) > _FREE_REFCOUNT]
+            if views:
+                mask |= 1 << slot
+
+        if mask != self._ring.get_claimed_mask():
+            self._ring._set(8, mask)
+
+
+class SharedMemoryFrameProducer:
+    """
+    Producer side of a SharedMemoryFrameSource, for the external renderer process.
+
+        producer = SharedMemoryFrameProducer(name)
+        width, height = producer.get_requested_size()
+        producer.write(image)
+
+    or, to render straight into shared memory:
+
+        out = producer.begin_frame(width, height)
+        ...fill out...
+        producer.end_frame()
+    """
+
+    def __init__(self, name: str):
+        self._ring = _FrameRing(_attach(name))
+        self._slot = None
+        self._seq  = 0
+
+    def get_requested_size(self) -> Tuple[int, int]:
+        return self._ring.get_requested_size()
+
+    def is_closed(self) -> bool:
+        return self._ring.is_closed()
+
+    def begin_frame(self, width: int, height: int) -> np.ndarray:
+        if width * height * self._ring.channels > self._ring.slot_capacity:
+            raise ValueError("frame is larger than the slots of the source")
+
+        if self._slot is not None:
+            raise RuntimeError("end_frame() was not called for the previous frame")
+
+        latest = self._ring.get_latest_slot()
+
+        for slot in range(self._ring.num_slots):
+            if slot == latest or self._ring.get_claimed_mask() & (1 << slot):
+                continue
+
+            # the slot is marked as being written before the claims are checked again,
+            # so a viewer claiming it meanwhile either sees the mark or is seen here
+            previous = self._ring.get_slot(slot)
+            self._ring.set_slot(slot, self._seq + 1, width, height)
+
+            if not self._ring.get_claimed_mask() & (1 << slot):
+                break
+
+            # the frame in it is untouched and still valid for the viewer
+            self._ring.set_slot(slot, *previous)
+        else:
+            raise RuntimeError("no free slot, the viewer holds on to every frame")
+
+        self._seq += 2
+        self._slot = slot
+
+        return self._ring.get_view(slot, width, height)
+
+    def end_frame(self) -> None:
+        slot, self._slot = self._slot, None
+        if slot is None:
+            raise RuntimeError("begin_frame() was not called")
+
+        _, width, height = self._ring.get_slot(slot)
+        self._ring.set_slot(slot, self._seq, width, height)
+        self._ring._set(7, slot)
+
+    def write(self, image: np.ndarray) -> None:
+        height, width = image.shape[:2]
+
+        out = self.begin_frame(width, height)
+        out[...] = image.reshape(out.shape)
+        del out
+
+        self.end_frame()
+
+    def close(self) -> None:
+        self._ring.segment.close()
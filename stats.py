@@ -0,0 +1,243 @@
+import bisect
+import collections
+import threading
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6)
+LATENCY_BUCKETS = (0.01, 0.02, 0.033, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+FRAME_COUNTERS = ("rendered", "sent", "unchanged", "deferred")
+
+
+def frame_bytes(frame: Dict) -> int:
+    if 'tiles' in frame:
+        return sum(len(tile['image']) for tile in frame['tiles'])
+
+    return len(frame.get('image', b''))
+
+
+class RollingHistogram:
+    """
+    Lifetime bucket counts (for Prometheus) plus the most recent samples (for percentiles).
+    """
+
+    def __init__(self, buckets: Sequence[float], window: int = 512):
+        self.buckets = tuple(buckets)
+
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+        self._samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum   = 0.0
+
+    def add(self, value: float) -> None:
+        self._bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._samples.append(value)
+        self.count += 1
+        self.sum   += value
+
+    def cumulative_buckets(self) -> List[Tuple[float, int]]:
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self._bucket_counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+    def summary(self) -> Dict[str, float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count}
+
+        def percentile(q):
+            return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+        return {
+            "count": self.count,
+            "mean":  sum(samples) / len(samples),
+            "p50":   percentile(0.50),
+            "p90":   percentile(0.90),
+            "p95":   percentile(0.95),
+            "p99":   percentile(0.99),
+            "max":   samples[-1],
+        }
+
+
+class SessionStats:
+
+    def __init__(self, window: int = 512, rate_window: float = 5.0):
+        self._lock = threading.Lock()
+
+        self.stages = {
+            "render": RollingHistogram(STAGE_BUCKETS, window),
+            "encode": RollingHistogram(STAGE_BUCKETS, window),
+            "emit":   RollingHistogram(STAGE_BUCKETS, window),
+        }
+        self.frame_bytes = RollingHistogram(BYTES_BUCKETS, window)
+        # input to frame: end to end as reported by the client, and up to the emit on the server
+        self.latencies = {
+            "client": RollingHistogram(LATENCY_BUCKETS, window),
+            "server": RollingHistogram(LATENCY_BUCKETS, window),
+        }
+        self.frames = {name: 0 for name in FRAME_COUNTERS}
+        # set by bandwidth adaptation: quality, scale, estimated and sent bits per second
+        self.bandwidth: Dict[str, float] = {}
+
+        self.input_events = 0
+        self._rate_window = rate_window
+        self._input_times = collections.deque()
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage].add(seconds)
+
+    def record_sent(self, num_bytes: int) -> None:
+        with self._lock:
+            self.frames["sent"] += 1
+            self.frame_bytes.add(num_bytes)
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies[kind].add(seconds)
+
+    def set_bandwidth(self, **values) -> None:
+        with self._lock:
+            self.bandwidth.update(values)
+
+    def count_frame(self, name: str) -> None:
+        with self._lock:
+            self.frames[name] += 1
+
+    def record_input(self, count: int = 1) -> None:
+        now = time.time()
+
+        with self._lock:
+            self.input_events += count
+            self._input_times.extend([now] * count)
+            self._trim_input_times(now)
+
+    def get_input_rate(self) -> float:
+        with self._lock:
+            self._trim_input_times(time.time())
+            return len(self._input_times) / self._rate_window
+
+    def snapshot(self) -> Dict:
+        rate = self.get_input_rate()
+
+        with self._lock:
+            return {
+                "stages":          {name: hist.summary() for name, hist in self.stages.items()},
+                "frame_bytes":     self.frame_bytes.summary(),
+                "input_latency":   {kind: hist.summary() for kind, hist in self.latencies.items()},
+                "frames":          dict(self.frames),
+                "input_events":    self.input_events,
+                "input_rate":      rate,
+                "bandwidth":       dict(self.bandwidth),
+            }
+
+    def _trim_input_times(self, now: float) -> None:
+        while self._input_times and now - self._input_times[0] > self._rate_window:
+            self._input_times.popleft()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        items.append(f'{key}="{value}"')
+
+    return "{" + ",".join(items) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_histogram(lines: List[str], name: str, labels: Dict[str, str], hist: RollingHistogram) -> None:
+    for bound, count in hist.cumulative_buckets():
+        lines.append(f"{name}_bucket{_format_labels(dict(labels, le=_format_bound(bound)))} {count}")
+
+    lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+
+def format_prometheus(
+        sessions:        Iterable[Tuple[str, SessionStats, Dict[str, int]]],
+        live_sessions:   int,
+        reaped_sessions: int,
+    ) -> str:
+    # sessions yields (session label, stats, extra frame counters such as dropped frames)
+    sessions = list(sessions)
+    lines = []
+
+    lines.append("# HELP webviewer_sessions Number of sessions being rendered.")
+    lines.append("# TYPE webviewer_sessions gauge")
+    lines.append(f"webviewer_sessions {live_sessions}")
+    lines.append("# HELP webviewer_sessions_reaped_total Sessions stopped and reclaimed.")
+    lines.append("# TYPE webviewer_sessions_reaped_total counter")
+    lines.append(f"webviewer_sessions_reaped_total {reaped_sessions}")
+
+    lines.append("# HELP webviewer_stage_seconds Time spent per frame in each pipeline stage.")
+    lines.append("# TYPE webviewer_stage_seconds histogram")
+    for label, stats, _ in sessions:
+        with stats._lock:
+            for stage, hist in stats.stages.items():
+                _format_histogram(lines, "webviewer_stage_seconds", {"session": label, "stage": stage}, hist)
+
+    lines.append("# HELP webviewer_frame_bytes Encoded size of the frames sent.")
+    lines.append("# TYPE webviewer_frame_bytes histogram")
+    for label, stats, _ in sessions:
+        with stats._lock:
+            _format_histogram(lines, "webviewer_frame_bytes", {"session": label}, stats.frame_bytes)
+
+    lines.append("# HELP webviewer_input_latency_seconds Time from an input to the first frame reflecting it.")
+    lines.append("# TYPE webviewer_input_latency_seconds histogram")
+    for label, stats, _ in sessions:
+        with stats._lock:
+            for kind, hist in stats.latencies.items():
+                _format_histogram(lines, "webviewer_input_latency_seconds", {"session": label, "measured": kind}, hist)
+
+    lines.append("# HELP webviewer_frames_total Frames by outcome.")
+    lines.append("# TYPE webviewer_frames_total counter")
+    for label, stats, extra in sessions:
+        with stats._lock:
+            frames = dict(stats.frames)
+
+        frames.update(extra)
+        for kind, count in frames.items():
+            lines.append(f"webviewer_frames_total{_format_labels({'session': label, 'kind': kind})} {count}")
+
+    lines.append("# HELP webviewer_input_events_total Input events received.")
+    lines.append("# TYPE webviewer_input_events_total counter")
+    for label, stats, _ in sessions:
+        lines.append(f"webviewer_input_events_total{_format_labels({'session': label})} {stats.input_events}")
+
+    lines.append("# HELP webviewer_input_events_per_second Input events per second over the last few seconds.")
+    lines.append("# TYPE webviewer_input_events_per_second gauge")
+    for label, stats, _ in sessions:
+        lines.append(f"webviewer_input_events_per_second{_format_labels({'session': label})} {stats.get_input_rate()}")
+
+    lines.append("# HELP webviewer_jpeg_quality Encoder quality picked by bandwidth adaptation.")
+    lines.append("# TYPE webviewer_jpeg_quality gauge")
+    for label, stats, _ in sessions:
+        with stats._lock:
+            quality = stats.bandwidth.get("quality")
+        if quality is not None:
+            lines.append(f"webviewer_jpeg_quality{_format_labels({'session': label})} {quality}")
+
+    lines.append("# HELP webviewer_bandwidth_bits_per_second Estimated link bandwidth and bitrate sent.")
+    lines.append("# TYPE webviewer_bandwidth_bits_per_second gauge")
+    for label, stats, _ in sessions:
+        with stats._lock:
+            bandwidth = dict(stats.bandwidth)
+        for kind in ("estimated", "sent"):
+            if bandwidth.get(kind) is not None:
+                lines.append(f"webviewer_bandwidth_bits_per_second{_format_labels({'session': label, 'kind': kind})} {bandwidth[kind]}")
+
+    return "\n".join(lines) + "\n"
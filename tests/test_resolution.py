@@ -0,0 +1,73 @@
+import math
+import random
+
+from ..resolution import ResolutionController
+
+
+TARGET_FRAME_RATE = 60.0
+
+
+def _replay(controller, width, height, frames, render_cost, encode_cost, aspect_ratio, jitter=0.05, seed=0):
+    # feeds a synthetic trace of render and encode times, a fixed cost per pixel
+    # with a few percent of noise, and returns the sizes the controller picked and
+    # the frame time error it saw for each of them
+    rng = random.Random(seed)
+    sizes = []
+    errors = []
+
+    for _ in range(frames):
+        pixels = width * height
+        controller.record("render", render_cost * pixels * (1.0 + rng.uniform(-jitter, jitter)), pixels)
+        controller.record("encode", encode_cost * pixels * (1.0 + rng.uniform(-jitter, jitter)), pixels)
+        errors.append(math.log(controller.predict_frame_time(pixels) * TARGET_FRAME_RATE))
+
+        width, height = controller.update(
+            width,
+            height,
+            aspect_ratio      = aspect_ratio,
+            target_frame_rate = TARGET_FRAME_RATE,
+            min_pixel         = 64,
+            max_pixel         = 4096,
+        )
+        sizes.append((width, height))
+
+    return sizes, errors
+
+
+def _frame_time_error(width, height, render_cost, encode_cost):
+    return math.log((render_cost + encode_cost) * width * height * TARGET_FRAME_RATE)
+
+
+def test_converges_to_target_frame_time():
+    for width, height in ((320, 180), (3200, 1800)):
+        controller = ResolutionController()
+        sizes, _ = _replay(controller, width, height, 60, 1e-8, 5e-9, 0.5625)
+
+        width, height = sizes[-1]
+        assert abs(_frame_time_error(width, height, 1e-8, 5e-9)) <= controller.deadband + 0.05
+        assert abs(height / width - 0.5625) < 0.01
+
+
+def test_stays_put_within_deadband():
+    for aspect_ratio in (0.5625, 0.6, 0.75, 1.0, 1.3):
+        controller = ResolutionController()
+        sizes, errors = _replay(controller, 640, int(640 * aspect_ratio), 200, 1e-8, 5e-9, aspect_ratio)
+
+        # an error within the deadband must not move the size, not even by a pixel
+        for previous, size, error in zip(sizes[:-1], sizes[1:], errors[1:]):
+            if abs(error) <= controller.deadband:
+                assert size == previous
+
+        # and once settled the noise must not make it hunt around the target
+        assert len(set(sizes[60:])) <= 2
+
+
+def test_follows_a_change_in_cost():
+    controller = ResolutionController()
+    sizes, _ = _replay(controller, 640, 360, 60, 1e-8, 5e-9, 0.5625)
+
+    width, height = sizes[-1]
+    sizes, _ = _replay(controller, width, height, 60, 4e-8, 5e-9, 0.5625, seed=1)
+
+    width, height = sizes[-1]
+    assert abs(_frame_time_error(width, height, 4e-8, 5e-9)) <= controller.deadband + 0.05
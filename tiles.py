@@ -0,0 +1,204 @@
+import threading
+import numpy as np
+from typing import Callable, Dict, Optional
+
+
+def changed_tiles(previous: np.ndarray, current: np.ndarray, tile_size: int) -> np.ndarray:
+    """
+    Returns the (row, col) indices of the tiles in which the two frames differ.
+    """
+    if previous.shape != current.shape:
+        raise ValueError("frames must have the same shape")
+
+    height, width = current.shape[:2]
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+
+    diff = previous != current
+    if diff.ndim == 3:
+        diff = diff.any(axis=2)
+
+    diff = np.pad(diff, ((0, rows * tile_size - height), (0, cols * tile_size - width)))
+    mask = diff.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+    return np.argwhere(mask)
+
+
+class DeltaFrame:
+    """
+    A frame diffed against a snapshot of the reference frame, in the encode
+    stage. It is only valid while that snapshot is still the frame the client
+    shows, which DeltaEncoder.commit() checks when the frame is sent.
+
+    `frame` is None when nothing changed against the snapshot, `reference` is
+    the frame the client shows once this one is applied.
+    """
+
+    def __init__(
+            self,
+            encoder:           "DeltaEncoder",
+            frame:             Optional[Dict],
+            reference:         Optional[np.ndarray],
+            base:              int,
+            keyframe:          bool,
+            keyframe_requests: int,
+        ):
+        self.encoder           = encoder
+        self.frame             = frame
+        self.reference         = reference
+        self.base              = base
+        self.keyframe          = keyframe
+        self.keyframe_requests = keyframe_requests
+
+
+# returned by _encode_delta() when a keyframe is cheaper than the delta
+_KEYFRAME = object()
+
+
+class DeltaEncoder:
+    """
+    Common bookkeeping of the delta encoders. encode() diffs against a snapshot
+    of the last frame that was sent and changes nothing, so it can run on any
+    encode thread; commit() is called when the frame is actually sent and only
+    swaps the reference. A frame whose snapshot is no longer the reference
+    (another frame was sent in between) is rejected and must be encoded again.
+    """
+
+    def __init__(self, keyframe_interval: int):
+        if not isinstance(keyframe_interval, int) or keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be an integer greater than or equal to 1")
+
+        self.keyframe_interval = keyframe_interval
+
+        self._lock = threading.Lock()
+        self._reference: Optional[np.ndarray] = None
+        self._version          = 0
+        self._frames_since_key = 0
+        # keyframe requests made and answered by a committed keyframe; the first frame is a keyframe
+        self._keyframe_requests = 1
+        self._served_requests   = 0
+
+    def request_keyframe(self) -> None:
+        with self._lock:
+            self._keyframe_requests += 1
+
+    def encode(
+            self,
+            image:        np.ndarray,
+            encode_image: Optional[Callable[[np.ndarray], bytes]] = None,
+        ) -> DeltaFrame:
+        image = self._prepare(image)
+
+        with self._lock:
+            reference = self._reference
+            base      = self._version
+            requests  = self._keyframe_requests
+
+            need_keyframe = (
+                requests != self._served_requests
+                or reference is None
+                or reference.shape != image.shape
+                or self._frames_since_key + 1 >= self.keyframe_interval
+            )
+
+        frame = None if need_keyframe else self._encode_delta(reference, image, encode_image)
+
+        keyframe = need_keyframe or frame is _KEYFRAME
+        if keyframe:
+            frame = self._encode_key(image, encode_image)
+
+        # the image may be a reused render buffer, the reference needs a copy of its own
+        new_reference = image.copy() if frame is not None else None
+
+        return DeltaFrame(self, frame, new_reference, base, keyframe, requests)
+
+    def commit(self, delta: DeltaFrame) -> bool:
+        # False if the frame was diffed against a reference the client no longer shows
+        with self._lock:
+            if delta.base != self._version:
+                return False
+
+            if delta.frame is None:
+                return True
+
+            self._reference = delta.reference
+            self._version  += 1
+
+            if delta.keyframe:
+                self._frames_since_key = 0
+                self._served_requests  = max(self._served_requests, delta.keyframe_requests)
+            else:
+                self._frames_since_key += 1
+
+            return True
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        return image
+
+    def _encode_key(self, image: np.ndarray, encode_image: Optional[Callable[[np.ndarray], bytes]]) -> Dict:
+        raise NotImplementedError
+
+    def _encode_delta(
+            self,
+            reference:    np.ndarray,
+            image:        np.ndarray,
+            encode_image: Optional[Callable[[np.ndarray], bytes]],
+        ):
+        # the delta frame, None if nothing changed or _KEYFRAME
+        raise NotImplementedError
+
+
+class TileDeltaEncoder(DeltaEncoder):
+    """
+    Sends only the tiles that changed since the last frame that was sent, with a
+    full keyframe on the first frame, on request, after a size change,
+    every `keyframe_interval` frames, and whenever more than `max_changed_ratio`
+    of the tiles changed.
+    """
+
+    def __init__(
+            self,
+            tile_size:         int   = 64,
+            keyframe_interval: int   = 120,
+            max_changed_ratio: float = 0.5,
+        ):
+        if not isinstance(tile_size, int) or tile_size < 8:
+            raise ValueError("tile_size must be an integer greater than or equal to 8")
+
+        if not 0 < max_changed_ratio <= 1:
+            raise ValueError("max_changed_ratio must be in (0, 1]")
+
+        super().__init__(keyframe_interval)
+
+        self.tile_size         = tile_size
+        self.max_changed_ratio = max_changed_ratio
+
+    def _encode_key(self, image: np.ndarray, encode_image: Callable[[np.ndarray], bytes]) -> Dict:
+        return {'type': 'key', 'image': encode_image(image), 'width': image.shape[1], 'height': image.shape[0]}
+
+    def _encode_delta(self, reference: np.ndarray, image: np.ndarray, encode_image: Callable[[np.ndarray], bytes]):
+        tiles = changed_tiles(reference, image, self.tile_size)
+
+        if len(tiles) == 0:
+            return None
+
+        rows = -(-image.shape[0] // self.tile_size)
+        cols = -(-image.shape[1] // self.tile_size)
+        if len(tiles) > self.max_changed_ratio * rows * cols:
+            return _KEYFRAME
+
+        size = self.tile_size
+        tile_data = []
+        for row, col in tiles:
+            y, x = row * size, col * size
+            tile = image[y:y + size, x:x + size]
+
+            tile_data.append({
+                'x':      int(x),
+                'y':      int(y),
+                'width':  tile.shape[1],
+                'height': tile.shape[0],
+                'image':  encode_image(tile),
+            })
+
+        return {'type': 'delta', 'tiles': tile_data}